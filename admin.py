@@ -2,8 +2,6 @@ from user import User
 from database import Database
 from loan_system import LoanSystem
 from educational_hub import EducationalHub
-import csv
-import os
 
 class Admin(User):
     def __init__(self, name, user_id=None, email=None, password=None):
@@ -27,18 +25,11 @@ class Admin(User):
             
             if success:
                 # Execute any associated smart contracts
-                # Get all transactions to find the contract ID
-                transactions = transaction_manager.get_transactions(show_output=False)
-                contract_id = None
-                
-                # Find the contract ID for this transaction by checking blockchain records
-                contracts = transaction_manager.blockchain.get_contract_history()
-                for contract in contracts:
-                    # Try to match by transaction ID in the future
-                    # For now, we'll just execute the most recent contract
-                    if contract["status"] == "Created":
-                        contract_id = contract["contract_id"]
-                        break
+                # Try to match by transaction ID in the future
+                # For now, we'll just execute the first contract still waiting,
+                # found through the contract status index
+                created = transaction_manager.blockchain.get_contracts_by_status("Created", limit=1)
+                contract_id = created[0]["contract_id"] if created else None
                 
                 # Execute the smart contract if found
                 if contract_id:
@@ -53,45 +44,26 @@ class Admin(User):
             # Legacy approval method using buyer name and product name
             print(f"\n🔍 Admin {self.name} is approving {buyer_name}'s purchase of {product_name}...\n")
             
-            # Get transactions from CSV
-            transactions_file = os.path.join("data", "transactions.csv")
-            if not os.path.isfile(transactions_file):
+            # Get transactions from storage
+            if not Database.table_exists("transactions.csv"):
                 print("\n No transactions found.\n")
                 return False, "No transactions found"
             
-            with open(transactions_file, mode='r') as file:
-                reader = csv.reader(file)
-                headers = next(reader)  # Skip header row
-                transactions = list(reader)
-            
             # Find and update the transaction
-            updated_transactions = []
-            found = False
-            found_transaction_id = None
-            
-            for transaction in transactions:
-                # Check if this is the transaction we're looking for
-                if len(transaction) >= 3 and transaction[1] == buyer_name and transaction[2] == product_name and transaction[4] == "Pending":
-                    transaction[4] = "Approved"  # Update status
-                    found = True
-                    if len(transaction) >= 5:
-                        found_transaction_id = transaction[4]
-                    print(f"\n Transaction approved: {buyer_name}'s purchase of {product_name}\n")
-                updated_transactions.append(transaction)
-            
-            if not found:
+            # In transactions.csv: [Buyer Name, Product Name, Price, Status, Transaction ID]
+            match = {0: buyer_name, 1: product_name, 3: "Pending"}
+            transaction = Database.find_row("transactions.csv", match)
+            
+            if not transaction:
                 print("\n Transaction not found or already approved.\n")
                 return False, "Transaction not found or already approved"
             
-            # Write updated transactions back to CSV
-            with open(transactions_file, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(headers)
-                writer.writerows(updated_transactions)
-            
-            # If we found a transaction ID, also update in blockchain
-            if found_transaction_id:
-                transaction_manager.approve_transaction(found_transaction_id)
+            if len(transaction) >= 5 and transaction[4]:
+                # Approve through the transaction manager so the blockchain is mined as well
+                transaction_manager.approve_transaction(transaction[4])
+            else:
+                Database.update_rows("transactions.csv", match, {3: "Approved"})
+            print(f"\n Transaction approved: {buyer_name}'s purchase of {product_name}\n")
             
             return True, f"Transaction approved: {buyer_name}'s purchase of {product_name}"
         else:
@@ -139,13 +111,14 @@ class Admin(User):
         
         print("\n===== Loan Applications =====\n")
         for loan in filtered_loans:
-            if len(loan) >= 1:  # Ensure there's at least a loan ID
-                loan_id = loan[0]
-                farmer_id = loan[1] if len(loan) > 1 else "Unknown"
-                amount = loan[2] if len(loan) > 2 else "Unknown"
-                interest_rate = loan[3] if len(loan) > 3 else "Unknown"
-                application_date = loan[4] if len(loan) > 4 else "Unknown"
-                status = loan[5] if len(loan) > 5 else "Unknown"
+            # Loan records pad missing columns with "", so check the fields themselves
+            if loan.loan_id:  # Ensure there's at least a loan ID
+                loan_id = loan.loan_id
+                farmer_id = loan.farmer_id or "Unknown"
+                amount = loan.amount if loan.amount != "" else "Unknown"
+                interest_rate = loan.interest_rate if loan.interest_rate != "" else "Unknown"
+                application_date = loan.application_date or "Unknown"
+                status = loan.status or "Unknown"
                 
                 print(f"Loan ID: {loan_id}")
                 print(f"Farmer ID: {farmer_id}")
@@ -155,9 +128,9 @@ class Admin(User):
                 print(f"Status: {status}")
                 
                 # If loan is approved, show approval date and due date
-                if status == "Approved" and len(loan) >= 8:
-                    approval_date = loan[6] if len(loan) > 6 else "Unknown"
-                    due_date = loan[7] if len(loan) > 7 else "Unknown"
+                if status == "Approved" and loan.approval_date and loan.due_date:
+                    approval_date = loan.approval_date
+                    due_date = loan.due_date
                     print(f"Approval Date: {approval_date}")
                     print(f"Due Date: {due_date}")
                 
@@ -167,9 +140,8 @@ class Admin(User):
     
     def manage_users(self, action, user_id=None, new_data=None):
         """Manage users in the system (view, update, delete)"""
-        users = Database.read_from_csv(self.users_file)
-        
         if action == "view":
+            users = Database.read_from_csv(self.users_file)
             if not users:
                 return False, "No users found"
             
@@ -179,24 +151,9 @@ class Admin(User):
             return True, users
             
         elif action == "delete" and user_id:
-            updated_users = []
-            found = False
-            
-            for user in users:
-                if user[0] != user_id:
-                    updated_users.append(user)
-                else:
-                    found = True
-            
-            if not found:
+            if not Database.delete_rows(self.users_file, {0: user_id}):
                 return False, f"User with ID {user_id} not found"
             
-            # Write updated users back to CSV
-            with open(f"data/{self.users_file}", mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(self.headers)
-                writer.writerows(updated_users)
-            
             return True, f"User with ID {user_id} deleted successfully"
         
         return False, "Invalid action or missing user ID"
@@ -213,7 +170,7 @@ class Admin(User):
             approved = sum(1 for t in transactions if len(t) > 3 and t[3] == "Approved")
             
             # Calculate total value
-            total_value = sum(float(t[2]) for t in transactions if len(t) > 2 and t[2].replace('.', '', 1).isdigit())
+            total_value = sum(t.price for t in transactions if isinstance(t.price, float) and t.price >= 0)
             
             report = {
                 "total_transactions": len(transactions),
@@ -329,65 +286,42 @@ class Admin(User):
     
     def delete_educational_resource(self, resource_id):
         """Delete an educational resource from the system."""
-        # Get all resources
         hub = EducationalHub()
-        resources = Database.read_from_csv(hub.resources_file)
         
         # Find and remove the resource
-        updated_resources = []
-        found = False
-        
-        for resource in resources:
-            if len(resource) >= 1 and resource[0] == resource_id:
-                found = True
-                continue
-            updated_resources.append(resource)
-        
-        if not found:
+        if not Database.delete_rows(hub.resources_file, {0: resource_id}):
             print(f"\n Resource with ID '{resource_id}' not found.\n")
             return False, f"Resource with ID '{resource_id}' not found"
         
-        # Write updated resources back to CSV
-        Database.update_csv_file(hub.resources_file, updated_resources)
-        
         print(f"\n Resource with ID '{resource_id}' deleted successfully.\n")
         return True, f"Resource with ID '{resource_id}' deleted successfully"
     
     def update_educational_resource(self, resource_id, title=None, category=None, content=None, tags=None):
         """Update an existing educational resource."""
-        # Get all resources
         hub = EducationalHub()
-        resources = Database.read_csv_with_headers(hub.resources_file)
-        
-        if not resources or len(resources) < 2:
+        if not Database.read_from_csv(hub.resources_file):
             print("\n No resources found.\n")
             return False, "No resources found"
         
-        # Find and update the resource
-        headers = resources[0]
-        updated_resources = [headers]
-        found = False
-        
-        for resource in resources[1:]:
-            if len(resource) >= 1 and resource[0] == resource_id:
-                found = True
-                # Update fields if provided
-                if title and len(resource) > 1:
-                    resource[1] = title
-                if category and len(resource) > 2:
-                    resource[2] = category
-                if content and len(resource) > 3:
-                    resource[3] = content
-                if tags and len(resource) > 4:
-                    resource[4] = tags
-            updated_resources.append(resource)
-        
-        if not found:
+        # Find the resource
+        resource = Database.find_row(hub.resources_file, {0: resource_id})
+        if not resource:
             print(f"\n Resource with ID '{resource_id}' not found.\n")
             return False, f"Resource with ID '{resource_id}' not found"
         
-        # Write updated resources back to CSV
-        Database.update_csv_file(hub.resources_file, updated_resources)
+        # Update fields if provided
+        changes = {}
+        if title and len(resource) > 1:
+            changes[1] = title
+        if category and len(resource) > 2:
+            changes[2] = category
+        if content and len(resource) > 3:
+            changes[3] = content
+        if tags and len(resource) > 4:
+            changes[4] = tags
+        
+        if changes:
+            Database.update_rows(hub.resources_file, {0: resource_id}, changes)
         
         print(f"\n Resource with ID '{resource_id}' updated successfully.\n")
         return True, f"Resource with ID '{resource_id}' updated successfully"
@@ -420,11 +354,11 @@ class Admin(User):
         transaction_manager = TransactionManager()
         return transaction_manager.get_blockchain_transactions()
     
-    def verify_blockchain_integrity(self):
-        """Verify the integrity of the blockchain."""
+    def verify_blockchain_integrity(self, full=False):
+        """Verify the integrity of the blockchain; full=True re-checks every block on all cores for audits."""
         from transactions import TransactionManager
         transaction_manager = TransactionManager()
-        is_valid = transaction_manager.verify_blockchain()
+        is_valid = transaction_manager.verify_blockchain(full, parallel=full)
         if is_valid:
             print("\n Blockchain integrity verified. All transactions are secure.\n")
         else:
@@ -524,17 +458,31 @@ class Admin(User):
         transaction_manager = TransactionManager()
         return transaction_manager.get_blockchain_transactions()
     
-    def verify_blockchain_integrity(self):
-        """Verify the integrity of the blockchain."""
+    def verify_blockchain_integrity(self, full=False):
+        """Verify the integrity of the blockchain; full=True re-checks every block on all cores for audits."""
         from transactions import TransactionManager
         transaction_manager = TransactionManager()
-        is_valid = transaction_manager.verify_blockchain()
+        is_valid = transaction_manager.verify_blockchain(full, parallel=full)
         if is_valid:
             print("\n Blockchain integrity verified. All transactions are secure.\n")
         else:
             print("\n Blockchain integrity check failed. There may be tampering.\n")
         return is_valid
     
+    def reconcile_ledgers(self, full=False):
+        """Compare transactions.csv with the blocks sealed since the last run; full=True checks every block."""
+        from transactions import TransactionManager
+        transaction_manager = TransactionManager()
+        divergences = transaction_manager.reconcile(full)
+        if not divergences:
+            print("\n Transactions and blockchain ledger are in agreement.\n")
+        else:
+            print(f"\n {len(divergences)} divergences between transactions and the blockchain ledger:")
+            for divergence in divergences:
+                print(f"- {divergence['kind']}: {divergence['id']} ({divergence['detail']})")
+            print()
+        return divergences
+    
     def view_smart_contracts(self):
         """View all smart contracts in the system."""
         from transactions import TransactionManager
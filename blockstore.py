@@ -0,0 +1,241 @@
+import json
+import marshal
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from itertools import groupby
+from locks import FileLock
+
+SEGMENT_BLOCKS = 1000  # Blocks per segment file
+SEGMENT_MAGIC = b"FGBS"
+INDEX_MAGIC = b"FGBI"
+BLOCK_STORE_VERSION = 1
+COMPRESSION_LEVEL = 6
+LOCK_FILE = "lock"  # Locked by the process appending to or repairing the store
+
+_HEADER = struct.Struct("<4sH")
+_LENGTH = struct.Struct("<I")
+
+class BlockStore:
+    """
+    Append-only block storage split into segments of SEGMENT_BLOCKS blocks.
+
+    A segment file ("000000.seg") holds length-prefixed, zlib-compressed JSON
+    records, one per block. Its segment index ("000000.idx") holds the header
+    of each block and where its record starts, so headers are read without
+    decompressing any transactions, and segments before the first block
+    needed are not opened at all.
+
+    Records are (index, timestamp, previous_hash, hash, nonce, version,
+    merkle_root, transactions); index entries hold the first seven of those
+    followed by the offset and length of the record.
+
+    Several processes can share a store: appends and repairs hold a
+    FileLock on the store's lock file, so records are never written at the same position twice and
+    a record still being written is never taken for a torn one. Writers that
+    append after a block they read first do both inside locked().
+    """
+
+    def __init__(self, folder, recover=True):
+        """Open the store in folder; pass recover=False for readers that must not repair it"""
+        self.folder = folder
+        self._lock = threading.RLock()
+        os.makedirs(folder, exist_ok=True)
+        self._store_lock = FileLock(os.path.join(folder, LOCK_FILE))
+        if recover:
+            with self._lock, self._store_lock:
+                segments = self._segments()
+                if segments:
+                    self._recover(segments[-1])
+
+    @staticmethod
+    def has_blocks(folder):
+        """Return True if folder holds a block store with at least one segment"""
+        return os.path.isdir(folder) and any(name.endswith(".idx") for name in os.listdir(folder))
+
+    def _segment_path(self, segment):
+        return os.path.join(self.folder, f"{segment:06d}.seg")
+
+    def _index_path(self, segment):
+        return os.path.join(self.folder, f"{segment:06d}.idx")
+
+    def _segments(self):
+        """Return the numbers of the segments on disk, in order"""
+        return sorted(int(name[:-4]) for name in os.listdir(self.folder)
+                      if name.endswith(".idx") and name[:-4].isdigit())
+
+    @staticmethod
+    def _read_chunks(path, magic):
+        """Return (chunks, end) for a file of length-prefixed chunks; end is where the last whole chunk stops"""
+        try:
+            with open(path, mode='rb') as file:
+                data = file.read()
+        except OSError:
+            return [], 0
+        if len(data) < _HEADER.size or _HEADER.unpack_from(data) != (magic, BLOCK_STORE_VERSION):
+            return [], 0
+        chunks = []
+        offset = _HEADER.size
+        while offset + _LENGTH.size <= len(data):
+            (length,) = _LENGTH.unpack_from(data, offset)
+            if offset + _LENGTH.size + length > len(data):
+                break  # Torn write at the end of the file
+            chunks.append((offset, data[offset + _LENGTH.size:offset + _LENGTH.size + length]))
+            offset += _LENGTH.size + length
+        return chunks, offset
+
+    def _read_index(self, segment):
+        chunks, _ = self._read_chunks(self._index_path(segment), INDEX_MAGIC)
+        entries = []
+        for _, data in chunks:
+            try:
+                entries.append(marshal.loads(data))
+            except (EOFError, ValueError, TypeError):
+                break
+        return entries
+
+    @staticmethod
+    def _size(path):
+        """Return the size of a file, or 0 if it does not exist"""
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _decode(data):
+        return json.loads(zlib.decompress(data).decode("utf-8"))
+
+    def _recover(self, segment):
+        """
+        Make the index of the last segment match its records after a crash:
+        index entries for records that never made it to disk are dropped, and
+        records written without their index entry are indexed again. Call with
+        the store lock held.
+        """
+        chunks, end = self._read_chunks(self._segment_path(segment), SEGMENT_MAGIC)
+        entries = []
+        for offset, data in chunks:
+            try:
+                record = self._decode(data)
+            except (zlib.error, ValueError):
+                end = offset  # Keep only the records before the damaged one
+                break
+            entries.append(tuple(record[:7]) + (offset, len(data)))
+        if entries == self._read_index(segment) and self._size(self._segment_path(segment)) == end:
+            return
+        if end:
+            with open(self._segment_path(segment), mode='r+b') as file:
+                file.truncate(end)
+        elif os.path.isfile(self._segment_path(segment)):
+            os.remove(self._segment_path(segment))
+        self._write_chunks(self._index_path(segment), INDEX_MAGIC,
+                           [marshal.dumps(entry) for entry in entries], mode='wb')
+
+    @staticmethod
+    def _write_chunks(path, magic, chunks, mode='ab'):
+        """Append chunks to a file, writing its header first if it is new; return the offset of each"""
+        offsets = []
+        with open(path, mode=mode) as file:
+            if file.tell() == 0:
+                file.write(_HEADER.pack(magic, BLOCK_STORE_VERSION))
+            for data in chunks:
+                offsets.append(file.tell())
+                file.write(_LENGTH.pack(len(data)))
+                file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        return offsets
+
+    def __len__(self):
+        with self._lock:
+            segments = self._segments()
+            if not segments:
+                return 0
+            return segments[-1] * SEGMENT_BLOCKS + len(self._read_index(segments[-1]))
+
+    def version(self):
+        """Return a token that changes whenever blocks are appended"""
+        segments = self._segments()
+        if not segments:
+            return None
+        stat = os.stat(self._index_path(segments[-1]))
+        return (segments[-1], stat.st_mtime_ns, stat.st_size)
+
+    def _repair_tail(self):
+        """Recover the last segment if a writer that died left bytes past its last indexed record"""
+        segments = self._segments()
+        if not segments:
+            return
+        entries = self._read_index(segments[-1])
+        size = self._size(self._segment_path(segments[-1]))
+        if entries:
+            intact = size == entries[-1][7] + _LENGTH.size + entries[-1][8]
+        else:
+            intact = size in (0, _HEADER.size)
+        if not intact:
+            self._recover(segments[-1])
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold the store lock for a block of code, so no other process appends
+        in between; used to check the last block and append after it.
+        """
+        with self._lock, self._store_lock:
+            yield
+
+    def append(self, records):
+        """Append block records; return the position of the first one"""
+        with self._lock, self._store_lock:
+            self._repair_tail()
+            first = len(self)
+            position = first
+            records = list(records)
+            while records:
+                segment, filled = divmod(position, SEGMENT_BLOCKS)
+                batch, records = records[:SEGMENT_BLOCKS - filled], records[SEGMENT_BLOCKS - filled:]
+                encoded = [zlib.compress(json.dumps(list(record)).encode("utf-8"), COMPRESSION_LEVEL)
+                           for record in batch]
+                # Records go to disk before their index entries, so an index
+                # entry never points past the end of its segment
+                offsets = self._write_chunks(self._segment_path(segment), SEGMENT_MAGIC, encoded)
+                entries = [tuple(record[:7]) + (offset, len(data))
+                           for record, offset, data in zip(batch, offsets, encoded)]
+                self._write_chunks(self._index_path(segment), INDEX_MAGIC,
+                                   [marshal.dumps(entry) for entry in entries])
+                position += len(batch)
+            return first
+
+    def headers(self, start=0):
+        """Return (position, index entry) pairs from position start on, reading only the segments needed"""
+        with self._lock:
+            headers = []
+            for segment in self._segments():
+                if (segment + 1) * SEGMENT_BLOCKS <= start:
+                    continue
+                first = segment * SEGMENT_BLOCKS
+                headers.extend((first + number, entry)
+                               for number, entry in enumerate(self._read_index(segment))
+                               if first + number >= start)
+            return headers
+
+    def bodies(self, headers):
+        """Read the transactions of the blocks described by (position, index entry) pairs, one segment at a time"""
+        bodies = []
+        for segment, group in groupby(headers, key=lambda header: header[0] // SEGMENT_BLOCKS):
+            with open(self._segment_path(segment), mode='rb') as file:
+                data = file.read()
+            for _, entry in group:
+                start = entry[7] + _LENGTH.size
+                bodies.append(self._decode(data[start:start + entry[8]])[7])
+        return bodies
+
+    def read_transactions(self, position, offset, length):
+        """Read the transactions of the block record at offset in the segment holding position"""
+        with open(self._segment_path(position // SEGMENT_BLOCKS), mode='rb') as file:
+            file.seek(offset + _LENGTH.size)
+            data = file.read(length)
+        return self._decode(data)[7]
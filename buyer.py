@@ -39,7 +39,8 @@ class Buyer(User):
                     buyer_id=self.user_id,
                     seller_id=seller_id,
                     product_id=product_id,
-                    price=float(price)
+                    price=float(price),
+                    transaction_id=transaction_id
                 )
                 
                 # Add to purchase history
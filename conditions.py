@@ -0,0 +1,138 @@
+import re
+import time
+from functools import lru_cache
+from database import Database
+
+# Contract terms may end with the conditions that must hold before the
+# contract executes, after "Conditions:" and separated by ";", e.g.
+#
+#   "Standard purchase agreement. Conditions: delivery confirmed;
+#    payment within 72h; price within 5%; buyer limit 5000"
+#
+# Terms without a "Conditions:" part have no conditions, so they always pass.
+CONDITIONS_MARKER = re.compile(r"conditions\s*:", re.IGNORECASE)
+TEMPLATE_CACHE_SIZE = 256  # Distinct terms kept compiled
+WINDOW_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+class ContractState:
+    """
+    Marketplace and transaction state shared by the condition checks of a
+    batch of contracts.
+
+    Each part is loaded on first use, with one indexed lookup covering every
+    contract in the batch, so checking thousands of contracts reads each table
+    once rather than once per contract.
+    """
+
+    def __init__(self, contracts, now=None):
+        self.contracts = list(contracts)
+        self.now = now if now is not None else time.time()
+        self._listings = None  # product_id -> listed price
+        self._confirmed = None  # (buyer_id, product_id) pairs sealed in a block
+        self._spent = None  # buyer_id -> amount of contracts executed before the batch
+        self._executed = {}  # buyer_id -> amount of contracts executed in the batch
+
+    def _buyer_filters(self):
+        return [{1: buyer_id} for buyer_id in {contract.buyer_id for contract in self.contracts}]
+
+    def listing_price(self, product_id):
+        if self._listings is None:
+            product_ids = {contract.product_id for contract in self.contracts}
+            self._listings = {row.product_id: row.price for row in Database.find_rows_any(
+                "marketplace.csv", [{0: product_id} for product_id in product_ids])}
+        return self._listings.get(product_id)
+
+    def delivery_confirmed(self, buyer_id, product_id):
+        if self._confirmed is None:
+            self._confirmed = {(row.buyer_id, row.product_id) for row in Database.find_rows_any(
+                "blockchain_transactions.csv", self._buyer_filters()) if row.status == "Confirmed"}
+        return (buyer_id, product_id) in self._confirmed
+
+    def spent(self, buyer_id):
+        if self._spent is None:
+            self._spent = {}
+            for row in Database.find_rows_any("smart_contracts.csv", self._buyer_filters()):
+                if row.status == "Executed":
+                    self._spent[row.buyer_id] = self._spent.get(row.buyer_id, 0) + float(row.price)
+        return self._spent.get(buyer_id, 0) + self._executed.get(buyer_id, 0)
+
+    def record_execution(self, contract):
+        """Count a contract executed in this batch towards its buyer's limit"""
+        self._executed[contract.buyer_id] = self._executed.get(contract.buyer_id, 0) + contract.price
+
+def _delivery_confirmed(_):
+    return lambda contract, state: state.delivery_confirmed(contract.buyer_id, contract.product_id)
+
+def _payment_within(match):
+    window = float(match.group(1)) * WINDOW_UNITS[match.group(2).lower()]
+    return lambda contract, state: state.now - contract.creation_time <= window
+
+def _price_within(match):
+    tolerance = float(match.group(1)) / 100
+
+    def check(contract, state):
+        listed = state.listing_price(contract.product_id)
+        if not isinstance(listed, float):
+            return False  # No listing to compare with
+        return abs(contract.price - listed) <= listed * tolerance
+    return check
+
+def _buyer_limit(match):
+    limit = float(match.group(1))
+    return lambda contract, state: state.spent(contract.buyer_id) + contract.price <= limit
+
+# (pattern, factory) pairs; a factory takes the match and returns check(contract, state)
+RULES = [
+    (re.compile(r"delivery confirmed", re.IGNORECASE), _delivery_confirmed),
+    (re.compile(r"payment within (\d+(?:\.\d+)?)\s*([mhd])", re.IGNORECASE), _payment_within),
+    (re.compile(r"price within (\d+(?:\.\d+)?)\s*%", re.IGNORECASE), _price_within),
+    (re.compile(r"buyer limit (\d+(?:\.\d+)?)", re.IGNORECASE), _buyer_limit),
+]
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_terms(terms):
+    """
+    Compile the conditions in contract terms into a tuple of (text, check)
+    pairs. Contracts made from the same template share the compiled checks.
+    An unknown condition compiles into a check that always fails.
+    """
+    found = CONDITIONS_MARKER.search(terms or "")
+    if not found:
+        return ()
+    conditions = []
+    for text in terms[found.end():].split(";"):
+        text = " ".join(text.split()).rstrip(".")
+        if not text:
+            continue
+        for pattern, factory in RULES:
+            match = pattern.fullmatch(text)
+            if match:
+                conditions.append((text, factory(match)))
+                break
+        else:
+            conditions.append((f"unknown condition '{text}'", lambda contract, state: False))
+    return tuple(conditions)
+
+def check_conditions(contract, state=None):
+    """Return (True, message) if every condition of a contract holds, else (False, the failed one)"""
+    conditions = compile_terms(contract.terms)
+    if conditions and state is None:
+        state = ContractState([contract])
+    for text, check in conditions:
+        if not check(contract, state):
+            return False, f"Contract conditions not met: {text}"
+    return True, "Contract conditions met"
+
+def evaluate_contracts(contracts, state=None):
+    """
+    Check the conditions of many contracts against one shared ContractState.
+    Contracts that pass count towards buyer limits for the ones after them.
+    Returns {contract_id: (passed, message)}.
+    """
+    state = state or ContractState(contracts)
+    results = {}
+    for contract in contracts:
+        results[contract.contract_id] = check_conditions(contract, state)
+        if results[contract.contract_id][0]:
+            state.record_execution(contract)
+    return results
@@ -1,71 +1,275 @@
-import csv
 import os
+import threading
+from schema import get_schema
+from storage import DATA_FOLDER, STORAGE_ENGINE, create_backend
 
-DATA_FOLDER = "data"
-if not os.path.exists(DATA_FOLDER):
-    os.makedirs(DATA_FOLDER)
+# Default limits after which a BatchWriter flushes its buffered rows
+BATCH_MAX_ROWS = 1000
+BATCH_MAX_DELAY = 1.0  # seconds
+
+# Batch opened with "with Database.batch():" on the current thread, if any
+_active_batch = threading.local()
+
+class BatchWriter:
+    """
+    Buffers rows per table and writes each table's rows with one append.
+
+    A flush opens each table once, writes all of its buffered rows and syncs
+    them to disk. It happens when max_rows rows are buffered, when the oldest
+    buffered row is max_delay seconds old, on flush() and on close(). Used as a
+    context manager, the batch also captures Database.write_to_csv calls made
+    on the same thread and is flushed when the block ends, so max_delay only
+    applies to writers used without "with".
+    """
+
+    def __init__(self, max_rows=BATCH_MAX_ROWS, max_delay=BATCH_MAX_DELAY):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._tables = {}  # filename -> (headers, rows)
+        self._count = 0
+        self._lock = threading.RLock()
+        self._timer = None
+        self._previous = None
+        self._scoped = False  # Inside a "with" block, which flushes on exit
+
+    def write(self, filename, data, headers):
+        """Buffer one row for a table"""
+        with self._lock:
+            if filename not in self._tables:
+                self._tables[filename] = (headers, [])
+            self._tables[filename][1].append(data)
+            self._count += 1
+            if self._count >= self.max_rows:
+                self.flush()
+            elif self._timer is None and self.max_delay is not None and not self._scoped:
+                self._timer = threading.Timer(self.max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def pending(self, filename=None):
+        """Return the number of buffered rows, for one table or overall"""
+        with self._lock:
+            if filename is None:
+                return self._count
+            return len(self._tables.get(filename, (None, []))[1])
+
+    def flush(self, filename=None):
+        """Write buffered rows, for one table or for all of them"""
+        with self._lock:
+            if self._timer is not None and filename is None:
+                self._timer.cancel()
+                self._timer = None
+            names = [filename] if filename is not None else list(self._tables)
+            for name in names:
+                if name not in self._tables:
+                    continue
+                headers, rows = self._tables.pop(name)
+                self._count -= len(rows)
+                Database.backend.append_rows(name, rows, headers, sync=True)
+
+    def close(self):
+        """Flush everything that is still buffered"""
+        self.flush()
+
+    def __enter__(self):
+        self._previous = getattr(_active_batch, "writer", None)
+        _active_batch.writer = self
+        self._scoped = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active_batch.writer = self._previous
+        self._scoped = False
+        self.close()
+        return False
 
 class Database:
+    # Storage engine behind every Database call; swap it with use_backend()
+    backend = create_backend(STORAGE_ENGINE)
+
     @staticmethod
-    def write_to_csv(filename, data, headers):
-        file_path = os.path.join(DATA_FOLDER, filename)
-        file_exists = os.path.isfile(file_path)
+    def use_backend(backend):
+        """Route all persistence through another StorageBackend"""
+        Database.backend = backend
+
+    @staticmethod
+    def data_path(name):
+        """Return the path of a file kept in the data folder next to the tables"""
+        return os.path.join(DATA_FOLDER, name)
+
+    @staticmethod
+    def batch(max_rows=BATCH_MAX_ROWS, max_delay=BATCH_MAX_DELAY):
+        """Start a BatchWriter; use it with "with" or call write()/close() on it"""
+        return BatchWriter(max_rows, max_delay)
 
-        with open(file_path, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            if not file_exists or os.stat(file_path).st_size == 0:
-                writer.writerow(headers)
-            writer.writerow(data)
+    @staticmethod
+    def _flush_pending(filename):
+        """Flush rows the current thread's batch holds for a table before using it"""
+        writer = getattr(_active_batch, "writer", None)
+        if writer is not None and writer.pending(filename):
+            writer.flush(filename)
+
+    @staticmethod
+    def _to_record(filename, row):
+        """Convert one raw row into the table's record type (a list if it has none)"""
+        schema = get_schema(filename)
+        return schema.parse(row) if schema else list(row)
+
+    @staticmethod
+    def _to_records(filename, rows):
+        """
+        Convert a whole table (header first) into records.
+
+        Records are immutable, so the backend keeps the converted table next
+        to its cached rows and hands it out again until the table changes.
+        """
+        schema = get_schema(filename)
+        if schema is None:
+            # Callers are free to modify plain rows, so hand out copies
+            return [list(row) for row in rows]
+        return Database.backend.derived(
+            filename, rows,
+            lambda rows: [list(rows[0])] + [schema.parse(row) for row in rows[1:]] if rows else [])
+
+    @staticmethod
+    def write_to_csv(filename, data, headers):
+        writer = getattr(_active_batch, "writer", None)
+        if writer is not None:
+            writer.write(filename, data, headers)
+        else:
+            Database.backend.append_rows(filename, [data], headers)
 
     @staticmethod
     def read_from_csv(filename):
         """Read data from CSV file, skipping the header row"""
-        file_path = os.path.join(DATA_FOLDER, filename)
-        if not os.path.isfile(file_path):
+        Database._flush_pending(filename)
+        rows = Database._to_records(filename, Database.backend.read_table(filename))
+        if len(rows) < 2:
             return []
+        return rows[1:]
 
-        with open(file_path, mode='r', newline='') as file:
-            reader = list(csv.reader(file))
-            if len(reader) < 2:
-                return []
-            return reader[1:]
-            
     @staticmethod
     def read_csv_with_headers(filename):
         """Read data from CSV file, including the header row"""
-        file_path = os.path.join(DATA_FOLDER, filename)
-        if not os.path.isfile(file_path):
-            return []
+        Database._flush_pending(filename)
+        rows = Database._to_records(filename, Database.backend.read_table(filename))
+        return [list(rows[0])] + rows[1:] if rows else []
+
+    @staticmethod
+    def iter_rows_with_headers(filename):
+        """Yield the header row and then each data row, parsing them one at a time"""
+        Database._flush_pending(filename)
+        rows = Database.backend.iter_rows(filename)
+        header = next(rows, None)
+        if header is None:
+            return
+        yield list(header)
+        for row in rows:
+            yield Database._to_record(filename, row)
+
+    @staticmethod
+    def iter_rows(filename, where=None):
+        """
+        Yield data rows one at a time, skipping the header row.
+
+        where is either a {column index: value} dict, which the storage engine
+        filters on, or a function that takes a row and returns True to keep it.
+        """
+        Database._flush_pending(filename)
+        match = where if isinstance(where, dict) else None
+        rows = Database.backend.iter_rows(filename, match)
+        next(rows, None)  # Skip header
+        for row in rows:
+            row = Database._to_record(filename, row)
+            if match is None and where is not None and not where(row):
+                continue
+            yield row
+
+    @staticmethod
+    def iter_rows_between(filename, first_month=None, last_month=None, where=None):
+        """
+        Yield the data rows of a date-partitioned table dated within an
+        inclusive range of "YYYY-MM" months; where works as in iter_rows.
+        """
+        Database._flush_pending(filename)
+        match = where if isinstance(where, dict) else None
+        rows = Database.backend.iter_period(filename, first_month, last_month, match)
+        next(rows, None)  # Skip header
+        for row in rows:
+            row = Database._to_record(filename, row)
+            if match is None and where is not None and not where(row):
+                continue
+            yield row
 
-        with open(file_path, mode='r', newline='') as file:
-            reader = list(csv.reader(file))
-            return reader
-    
     @staticmethod
     def update_csv_file(filename, data):
         """Update an entire CSV file with new data (including headers)"""
-        file_path = os.path.join(DATA_FOLDER, filename)
-        with open(file_path, mode='w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerows(data)
-            
+        Database._flush_pending(filename)
+        Database.backend.replace_table(filename, data)
+
+    @staticmethod
+    def table_exists(filename):
+        """Check whether a table has been created"""
+        Database._flush_pending(filename)
+        return Database.backend.table_exists(filename)
+
+    @staticmethod
+    def create_table(filename, headers):
+        """Create a table with the given headers unless it already exists"""
+        Database._flush_pending(filename)
+        Database.backend.create_table(filename, headers)
+
+    @staticmethod
+    def find_rows(filename, match, limit=None):
+        """Get rows whose columns equal the {column index: value} pairs in match"""
+        Database._flush_pending(filename)
+        return [Database._to_record(filename, row)
+                for row in Database.backend.find_rows(filename, match, limit)]
+
+    @staticmethod
+    def find_row(filename, match):
+        """Get the first row matching the {column index: value} pairs, or None"""
+        Database._flush_pending(filename)
+        rows = Database.backend.find_rows(filename, match, limit=1)
+        return Database._to_record(filename, rows[0]) if rows else None
+
+    @staticmethod
+    def find_rows_any(filename, matches):
+        """Get rows matching at least one of several {column index: value} filters"""
+        Database._flush_pending(filename)
+        return [Database._to_record(filename, row)
+                for row in Database.backend.find_rows_any(filename, matches)]
+
+    @staticmethod
+    def update_rows(filename, match, changes):
+        """Set {column index: value} changes on matching rows and return how many changed"""
+        Database._flush_pending(filename)
+        return Database.backend.update_rows(filename, match, changes)
+
+    @staticmethod
+    def update_many(filename, updates):
+        """Apply a list of (match, changes) updates in one storage pass and return how many rows changed"""
+        Database._flush_pending(filename)
+        return Database.backend.update_many(filename, updates)
+
+    @staticmethod
+    def delete_rows(filename, match):
+        """Delete matching rows and return how many were removed"""
+        Database._flush_pending(filename)
+        return Database.backend.delete_rows(filename, match)
+
     @staticmethod
     def get_loans_by_status(filename, status):
         """Get all loans with a specific status"""
-        loans = Database.read_from_csv(filename)
-        return [loan for loan in loans if len(loan) >= 6 and loan[5] == status]
-    
+        return list(Database.iter_rows(filename, where={5: status}))
+
     @staticmethod
     def get_loans_by_farmer(filename, farmer_id):
         """Get all loans for a specific farmer"""
-        loans = Database.read_from_csv(filename)
-        return [loan for loan in loans if len(loan) >= 2 and loan[1] == farmer_id]
-    
+        return list(Database.iter_rows(filename, where={1: farmer_id}))
+
     @staticmethod
     def get_loan_by_id(filename, loan_id):
         """Get a specific loan by ID"""
-        loans = Database.read_from_csv(filename)
-        for loan in loans:
-            if len(loan) >= 1 and loan[0] == loan_id:
-                return loan
-        return None
+        # Stops reading at the first match
+        return next(Database.iter_rows(filename, where={0: loan_id}), None)
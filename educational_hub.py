@@ -1,5 +1,3 @@
-import os
-import csv
 from database import Database
 
 class EducationalHub:
@@ -16,8 +14,7 @@ class EducationalHub:
         resource_headers = ["resource_id", "title", "category", "content", "tags", "date_added"]
         
         # Initialize file if it doesn't exist
-        data_path = os.path.join("data", self.resources_file)
-        if not os.path.exists(data_path):
+        if not Database.table_exists(self.resources_file):
             self._initialize_default_resources(resource_headers)
     
     def _initialize_default_resources(self, headers):
@@ -40,9 +37,10 @@ class EducationalHub:
              "irrigation,water,conservation", "2025-03-21"]
         ]
         
-        # Write default resources to the file
-        for resource in default_resources:
-            Database.write_to_csv(self.resources_file, resource, headers)
+        # Write default resources to the file in one batch
+        with Database.batch():
+            for resource in default_resources:
+                Database.write_to_csv(self.resources_file, resource, headers)
     
     def view_all_resources(self):
         """View all educational resources available in the system."""
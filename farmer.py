@@ -58,7 +58,8 @@ class Farmer(User):
         
         print("\n===== Your Loan Applications =====\n")
         for loan in farmer_loans:
-            if len(loan) >= 6:
+            # Loan records pad missing columns with "", so check the fields themselves
+            if loan.loan_id and loan.status:
                 loan_id = loan[0]
                 amount = loan[2]
                 interest_rate = loan[3]
@@ -72,7 +73,7 @@ class Farmer(User):
                 print(f"Status: {status}")
                 
                 # If loan is approved, show due date and remaining balance
-                if status == "Approved" and len(loan) >= 8:
+                if status == "Approved" and loan.approval_date and loan.due_date:
                     approval_date = loan[6]
                     due_date = loan[7]
                     print(f"Approval Date: {approval_date}")
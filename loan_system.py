@@ -1,5 +1,3 @@
-import os
-import csv
 import uuid
 import datetime
 from database import Database
@@ -21,13 +19,8 @@ class LoanSystem:
         repayment_headers = ["repayment_id", "loan_id", "amount", "date"]
         
         # Initialize files if they don't exist
-        data_path = os.path.join("data", self.loans_file)
-        if not os.path.exists(data_path):
-            Database.write_to_csv(self.loans_file, [], loan_headers)
-            
-        data_path = os.path.join("data", self.repayments_file)
-        if not os.path.exists(data_path):
-            Database.write_to_csv(self.repayments_file, [], repayment_headers)
+        Database.create_table(self.loans_file, loan_headers)
+        Database.create_table(self.repayments_file, repayment_headers)
 
     def apply_for_loan(self, farmer_id, amount, interest_rate):
         """
@@ -82,53 +75,30 @@ class LoanSystem:
         Returns:
             tuple: (success, message)
         """
-        # Get all loans with headers
-        loans = Database.read_csv_with_headers(self.loans_file)
+        loan = Database.get_loan_by_id(self.loans_file, loan_id)
         
-        if not loans:
-            return False, "No loan applications found"
+        if not loan:
+            return False, f"Loan with ID {loan_id} not found"
             
         try:
-            headers = loans[0]  # Save headers
-            updated_loans = [headers]  # Start with headers
-            found = False
+            # If already approved or rejected, return error
+            status = loan[5] if len(loan) > 5 else ""
+            if status != "Pending":
+                return False, f"Loan {loan_id} is already {status}"
             
-            # Process each loan row (skip header)
-            for loan in loans[1:]:
-                if len(loan) >= 1 and loan[0] == loan_id:
-                    found = True
-                    
-                    # Ensure loan has enough elements
-                    while len(loan) < 8:
-                        loan.append("")  # Pad with empty strings if needed
-                    
-                    # If already approved or rejected, return error
-                    if loan[5] != "Pending":
-                        return False, f"Loan {loan_id} is already {loan[5]}"
-                    
-                    # Update loan status
-                    status = "Approved" if approved else "Rejected"
-                    approval_date = datetime.datetime.now().strftime("%Y-%m-%d")
-                    
-                    # Calculate due date (6 months from approval)
-                    due_date = (datetime.datetime.now() + datetime.timedelta(days=180)).strftime("%Y-%m-%d")
-                    
-                    # Update the loan record
-                    loan[5] = status
-                    loan[6] = approval_date
-                    
-                    if approved:
-                        loan[7] = due_date
-                    
-                    updated_loans.append(loan)
-                else:
-                    updated_loans.append(loan)
+            # Update loan status
+            status = "Approved" if approved else "Rejected"
+            approval_date = datetime.datetime.now().strftime("%Y-%m-%d")
+            changes = {5: status, 6: approval_date}
             
-            if not found:
-                return False, f"Loan with ID {loan_id} not found"
+            if approved:
+                # Calculate due date (6 months from approval)
+                changes[7] = (datetime.datetime.now() + datetime.timedelta(days=180)).strftime("%Y-%m-%d")
+            else:
+                changes[7] = loan[7] if len(loan) > 7 else ""
             
-            # Write the updated loans back to the CSV file
-            Database.update_csv_file(self.loans_file, updated_loans)
+            # Write the updated loan record back to storage
+            Database.update_rows(self.loans_file, {0: loan_id}, changes)
                 
             action = "approved" if approved else "rejected"
             return True, f"Loan {loan_id} has been {action} successfully"
@@ -151,16 +121,9 @@ class LoanSystem:
             return False, "Invalid loan ID or repayment amount"
         
         # Check if loan exists and is approved
-        loans = Database.read_from_csv(self.loans_file)
-        loan_exists = False
-        loan_approved = False
-        
-        for loan in loans:
-            if len(loan) >= 6 and loan[0] == loan_id:
-                loan_exists = True
-                if loan[5] == "Approved":
-                    loan_approved = True
-                break
+        loan = Database.get_loan_by_id(self.loans_file, loan_id)
+        loan_exists = loan is not None and len(loan) >= 6
+        loan_approved = loan_exists and loan[5] == "Approved"
         
         if not loan_exists:
             return False, f"Loan with ID {loan_id} not found"
@@ -215,26 +178,17 @@ class LoanSystem:
             return None
             
         try:
-            # Create a dictionary with available data
+            # Amounts were already converted to floats when the row was read
             loan_dict = {
-                "loan_id": loan[0],
+                "loan_id": loan.loan_id,
+                "farmer_id": loan.farmer_id,
+                "amount": float(loan.amount) if loan.amount else 0.0,
+                "interest_rate": float(loan.interest_rate) if loan.interest_rate else 0.0,
+                "application_date": loan.application_date,
+                "status": loan.status,
+                "approval_date": loan.approval_date,
+                "due_date": loan.due_date
             }
-            
-            # Add other fields if they exist
-            if len(loan) > 1:
-                loan_dict["farmer_id"] = loan[1]
-            if len(loan) > 2:
-                loan_dict["amount"] = float(loan[2]) if loan[2] else 0.0
-            if len(loan) > 3:
-                loan_dict["interest_rate"] = float(loan[3]) if loan[3] else 0.0
-            if len(loan) > 4:
-                loan_dict["application_date"] = loan[4]
-            if len(loan) > 5:
-                loan_dict["status"] = loan[5]
-            if len(loan) > 6:
-                loan_dict["approval_date"] = loan[6]
-            if len(loan) > 7:
-                loan_dict["due_date"] = loan[7]
                 
             return loan_dict
             
@@ -252,14 +206,7 @@ class LoanSystem:
         Returns:
             list: List of repayments for the loan
         """
-        repayments = Database.read_from_csv(self.repayments_file)
-        loan_repayments = []
-        
-        for repayment in repayments:
-            if len(repayment) >= 2 and repayment[1] == loan_id:
-                loan_repayments.append(repayment)
-        
-        return loan_repayments
+        return Database.find_rows(self.repayments_file, {1: loan_id})
 
     def calculate_remaining_balance(self, loan_id):
         """
@@ -286,7 +233,7 @@ class LoanSystem:
         
         # Calculate total repayments
         repayments = self.get_loan_repayments(loan_id)
-        total_repaid = sum(float(repayment[2]) for repayment in repayments if len(repayment) >= 3)
+        total_repaid = sum(float(repayment.amount) for repayment in repayments if repayment.amount != "")
         
         # Calculate remaining balance
         remaining_balance = total_with_interest - total_repaid
@@ -313,18 +260,23 @@ class LoanSystem:
         Returns:
             dict: Report with statistics about loans
         """
-        loans = Database.read_from_csv(self.loans_file)
-        
-        total_loans = len(loans)
-        approved_loans = len(Database.get_loans_by_status(self.loans_file, "Approved"))
-        pending_loans = len(Database.get_loans_by_status(self.loans_file, "Pending"))
-        rejected_loans = len(Database.get_loans_by_status(self.loans_file, "Rejected"))
-        
-        # Calculate total amount of approved loans
-        total_approved_amount = sum(
-            float(loan[2]) for loan in loans 
-            if len(loan) >= 6 and loan[5] == "Approved" and loan[2].replace('.', '', 1).isdigit()
-        )
+        total_loans = 0
+        status_counts = {"Approved": 0, "Pending": 0, "Rejected": 0}
+        total_approved_amount = 0
+        
+        # One streaming pass over the loans table
+        for loan in Database.iter_rows(self.loans_file):
+            total_loans += 1
+            if loan.status in status_counts:
+                status_counts[loan.status] += 1
+            
+            # Calculate total amount of approved loans
+            if loan.status == "Approved" and isinstance(loan.amount, float) and loan.amount >= 0:
+                total_approved_amount += loan.amount
+        
+        approved_loans = status_counts["Approved"]
+        pending_loans = status_counts["Pending"]
+        rejected_loans = status_counts["Rejected"]
         
         return {
             "total_loans": total_loans,
@@ -0,0 +1,90 @@
+import os
+import threading
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+class FileLock:
+    """
+    Exclusive lock shared by every process that opens the same lock file.
+
+    An OS lock on the file, released by the OS if its holder dies. It can be
+    taken again by the thread holding it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            if self._depth == 0:
+                file = open(self.path, mode='a+b')
+                try:
+                    self._lock_file(file)
+                except BaseException:
+                    file.close()
+                    raise
+                self._file = file
+            self._depth += 1
+        except BaseException:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._depth -= 1
+            if self._depth == 0:
+                file, self._file = self._file, None
+                try:
+                    self._unlock_file(file)
+                finally:
+                    file.close()
+        finally:
+            self._lock.release()
+        return False
+
+    @staticmethod
+    def is_held(path):
+        """Check whether a process holds the lock on path right now, without waiting for it"""
+        try:
+            file = open(path, mode='r+b')
+        except OSError:
+            return False  # Nobody has taken it since it was removed
+        with file:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            except OSError:
+                return True
+            FileLock._unlock_file(file)
+        return False
+
+    @staticmethod
+    def _lock_file(file):
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            return
+        file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue  # LK_LOCK gives up after about 10 seconds
+
+    @staticmethod
+    def _unlock_file(file):
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
@@ -1,5 +1,5 @@
 from database import Database
-from blockchain import Blockchain
+from blockchain import get_blockchain
 import uuid
 
 class Marketplace:
@@ -25,7 +25,7 @@ class Marketplace:
         Database.write_to_csv("marketplace.csv", product, ["Product ID", "Farmer ID", "Product Name", "Price"])
         
         # Store in blockchain
-        blockchain = Blockchain()
+        blockchain = get_blockchain()
         success, message = blockchain.store_product_listing(product_id, farmer_id, product_name, price)
         
         if success:
@@ -40,13 +40,12 @@ class Marketplace:
     @staticmethod
     def get_product_details(product_id):
         """Get details of a specific product"""
-        products = Database.read_from_csv("marketplace.csv")
-        for product in products:
-            if product[0] == product_id:
-                return {
-                    "product_id": product[0],
-                    "farmer_id": product[1],
-                    "product_name": product[2],
-                    "price": float(product[3]) if isinstance(product[3], str) else product[3]
-                }
+        product = Database.find_row("marketplace.csv", {0: product_id})
+        if product:
+            return {
+                "product_id": product[0],
+                "farmer_id": product[1],
+                "product_name": product[2],
+                "price": float(product[3]) if isinstance(product[3], str) else product[3]
+            }
         return None
@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from locks import FileLock
+
+MEMPOOL_COMPACT_BYTES = 256 * 1024  # Log size after which a drained mempool is rewritten
+MEMPOOL_RECENT_MINED = 10000  # Mined entries remembered for status()
+LOCK_SUFFIX = ".lock"
+
+class MempoolEntry:
+    """A pending transaction and the future its producer can poll"""
+
+    __slots__ = ("entry_id", "transaction", "miner_address", "added", "group", "future")
+
+    def __init__(self, entry_id, transaction, miner_address, added, group=None):
+        self.entry_id = entry_id
+        self.transaction = transaction
+        self.miner_address = miner_address
+        self.added = added
+        self.group = group  # Entries added together with add_many(grouped=True) share a group id
+        self.future = Future()
+
+class Mempool:
+    """
+    Durable queue of transactions waiting to be mined.
+
+    Every change is appended to a JSON-lines log: an "add" record when a
+    transaction arrives and a "mined" record once its block is stored. On
+    start the log is replayed, so transactions accepted before a restart are
+    still mined. The future of an entry resolves to the hash of the block
+    that holds it.
+
+    Several processes can share the log, and each one mines only its own
+    entries. An entry belongs to the Mempool that added it while that one is
+    open; once its process stops, the next Mempool to open takes the entry
+    over with a "claim" record. Every open Mempool holds a FileLock on
+    "<log>.<owner>.lock", which is how the others tell it is still running,
+    and changes to the log hold a FileLock on "<log>.lock".
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.owner = uuid.uuid4().hex[:12]
+        self._entries = {}  # entry id -> MempoolEntry, in arrival order
+        self._mined = OrderedDict()  # entry id -> block hash, most recent last
+        self._lock = threading.Condition()
+        self._log_lock = FileLock(path + LOCK_SUFFIX)
+        self._owner_lock = FileLock(self._owner_path(self.owner))
+        self._closed = False
+        self._load()
+
+    def _owner_path(self, owner):
+        return f"{self.path}.{owner}{LOCK_SUFFIX}"
+
+    def _owners(self):
+        """Return the owners that have a lock file next to the log"""
+        folder, name = os.path.split(self.path)
+        prefix = name + "."
+        return [entry[len(prefix):-len(LOCK_SUFFIX)] for entry in os.listdir(folder or ".")
+                if entry.startswith(prefix) and entry.endswith(LOCK_SUFFIX) and entry != name + LOCK_SUFFIX]
+
+    def _read_log(self):
+        """Return {entry id: (add record, owner)} for the entries of the log that are not mined"""
+        pending = {}
+        try:
+            with open(self.path, mode='r', encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Torn write
+                    if record.get("op") == "add":
+                        pending[record["id"]] = (record, record.get("owner"))
+                    elif record.get("op") == "claim":
+                        for entry_id in record.get("ids", []):
+                            if entry_id in pending:
+                                pending[entry_id] = (pending[entry_id][0], record.get("owner"))
+                    elif record.get("op") == "mined":
+                        for entry_id in record.get("ids", []):
+                            pending.pop(entry_id, None)
+        except FileNotFoundError:
+            pass
+        return pending
+
+    def _load(self):
+        """Register this Mempool and take over the entries of processes that stopped"""
+        with self._log_lock:
+            # Taken under the log lock, so no other Mempool can look at the
+            # owner file between its creation and its locking
+            self._owner_lock.__enter__()
+            running = {self.owner}
+            for owner in self._owners():
+                if owner == self.owner:
+                    continue
+                if FileLock.is_held(self._owner_path(owner)):
+                    running.add(owner)
+                else:
+                    try:
+                        os.remove(self._owner_path(owner))
+                    except OSError:
+                        pass
+            claimed = [record for record, owner in self._read_log().values() if owner not in running]
+            if claimed:
+                self._append({"op": "claim", "ids": [record["id"] for record in claimed], "owner": self.owner})
+        for record in claimed:
+            self._entries[record["id"]] = MempoolEntry(
+                record["id"], record["tx"], record.get("miner"), record.get("time", 0), record.get("group"))
+
+    def _append(self, *records):
+        with self._log_lock, open(self.path, mode='a+b') as file:
+            if file.tell():
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    file.write(b"\n")  # End a line torn by a crash, so it does not swallow the next record
+            file.write("".join(json.dumps(record) + "\n" for record in records).encode("utf-8"))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _compact(self):
+        """Rewrite the log with only the entries still pending; call with the log lock held"""
+        temp_path = self.path + ".tmp"
+        with open(temp_path, mode='w', encoding="utf-8") as file:
+            for record, owner in self._read_log().values():
+                file.write(json.dumps(dict(record, owner=owner)) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def close(self):
+        """Stop owning entries; whatever is still pending is taken over by the next Mempool opened"""
+        with self._log_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._owner_lock.__exit__(None, None, None)
+            try:
+                os.remove(self._owner_path(self.owner))
+            except OSError:
+                pass
+
+    def add(self, transaction, miner_address=None):
+        """Store a transaction durably and return its entry"""
+        return self.add_many([transaction], miner_address)[0]
+
+    def add_many(self, transactions, miner_address=None, grouped=False):
+        """
+        Store transactions durably with a single write and return their
+        entries. With grouped=True they are mined together in one block.
+        """
+        added = time.time()
+        group = uuid.uuid4().hex[:12] if grouped else None
+        entries = [MempoolEntry(uuid.uuid4().hex[:12], transaction, miner_address, added, group)
+                   for transaction in transactions]
+        records = []
+        for entry in entries:
+            record = {"op": "add", "id": entry.entry_id, "tx": entry.transaction,
+                      "miner": miner_address, "time": added, "owner": self.owner}
+            if group:
+                record["group"] = group
+            records.append(record)
+        with self._lock:
+            self._append(*records)
+            for entry in entries:
+                self._entries[entry.entry_id] = entry
+            self._lock.notify_all()
+        return entries
+
+    def pending(self, limit=None):
+        """Return pending entries, oldest first"""
+        with self._lock:
+            entries = list(self._entries.values())
+        return entries if limit is None else entries[:limit]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def status(self, entry_id):
+        """Return "pending", "mined" or "unknown" for an entry id"""
+        with self._lock:
+            if entry_id in self._entries:
+                return "pending"
+            return "mined" if entry_id in self._mined else "unknown"
+
+    def mark_mined(self, entries, block_hash):
+        """Record that entries were stored in a block and resolve their futures"""
+        with self._lock, self._log_lock:
+            self._append({"op": "mined", "ids": [entry.entry_id for entry in entries], "block": block_hash})
+            for entry in entries:
+                self._entries.pop(entry.entry_id, None)
+                self._mined[entry.entry_id] = block_hash
+            while len(self._mined) > MEMPOOL_RECENT_MINED:
+                self._mined.popitem(last=False)
+            if not self._entries and os.path.getsize(self.path) >= MEMPOOL_COMPACT_BYTES:
+                # Nothing of ours is pending; entries of other processes are kept
+                self._compact()
+            self._lock.notify_all()
+        for entry in entries:
+            if not entry.future.done():
+                entry.future.set_result(block_hash)
+
+    def wait(self, predicate, timeout=None):
+        """
+        Block until predicate() is true or timeout seconds pass. The predicate is
+        checked again whenever a transaction is added or mined, or wake() is called.
+        """
+        with self._lock:
+            return self._lock.wait_for(predicate, timeout)
+
+    def wake(self):
+        """Wake up threads blocked in wait()"""
+        with self._lock:
+            self._lock.notify_all()
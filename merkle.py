@@ -0,0 +1,62 @@
+import hashlib
+import json
+
+# Leaves and inner nodes are hashed with different prefixes, so an inner node
+# can never be passed off as a transaction
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+EMPTY_ROOT = hashlib.sha256(b"").hexdigest()
+
+def leaf_hash(transaction):
+    """Hash one transaction as a Merkle leaf"""
+    data = json.dumps(transaction, sort_keys=True).encode()
+    return hashlib.sha256(LEAF_PREFIX + data).hexdigest()
+
+def node_hash(left, right):
+    """Hash two child hashes into their parent"""
+    return hashlib.sha256(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+def _next_level(level):
+    # An odd node out is carried up unchanged rather than paired with itself
+    paired = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        paired.append(level[-1])
+    return paired
+
+def merkle_root(transactions):
+    """Return the Merkle root of a list of transactions"""
+    level = [leaf_hash(transaction) for transaction in transactions]
+    if not level:
+        return EMPTY_ROOT
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0]
+
+def merkle_proof(transactions, position):
+    """
+    Return the inclusion proof for the transaction at position.
+
+    The proof is a list of [side, hash] pairs from the leaf upwards, where side
+    says whether the sibling hash goes on the "left" or the "right".
+    """
+    level = [leaf_hash(transaction) for transaction in transactions]
+    proof = []
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append(["left" if sibling < position else "right", level[sibling]])
+        level = _next_level(level)
+        position //= 2
+    return proof
+
+def verify_proof(transaction, proof, root):
+    """Check that a transaction is part of the tree with the given root"""
+    current = leaf_hash(transaction)
+    for side, sibling in proof:
+        if side == "left":
+            current = node_hash(sibling, current)
+        elif side == "right":
+            current = node_hash(current, sibling)
+        else:
+            return False
+    return current == root
@@ -0,0 +1,226 @@
+from database import Database
+from snapshot import read_snapshot, write_snapshot
+
+CONTRACT_LINKS_FILE = "contract_links.csv"  # Contract ID -> IDs of the purchases it settles
+CONTRACT_LINK_HEADERS = ["Contract ID", "Transaction ID"]
+NO_PURCHASES = ""  # Transaction ID of the link that marks a contract whose purchases were not found
+RECONCILE_CHECKPOINT_FILE = "reconciliation.checkpoint"  # Last block checked by reconcile()
+TRANSACTIONS_FILE = "transactions.csv"  # [Buyer Name, Product Name, Price, Status, Transaction ID]
+BLOCKCHAIN_TRANSACTIONS_FILE = "blockchain_transactions.csv"
+CONTRACTS_FILE = "smart_contracts.csv"
+AMOUNT_TOLERANCE = 0.005
+
+class Reconciler:
+    """
+    Keeps transactions.csv in step with the blockchain ledger.
+
+    Each contract is linked to the IDs of the purchases it settles in the
+    contract links table, and a transaction ID reaches its transactions.csv
+    row through that table's ID index. Approvals go through the links, so
+    their cost does not grow with the transaction history. reconcile() checks
+    the blocks sealed since its last run against transactions.csv and the
+    contracts table and reports where they disagree.
+    """
+
+    def __init__(self, blockchain):
+        self.blockchain = blockchain
+        self.checkpoint_file = Database.data_path(RECONCILE_CHECKPOINT_FILE)
+        Database.create_table(CONTRACT_LINKS_FILE, CONTRACT_LINK_HEADERS)
+
+    @staticmethod
+    def link(contract_id, transaction_ids):
+        """Record that a contract settles the given transactions"""
+        with Database.batch():
+            for transaction_id in transaction_ids:
+                Database.write_to_csv(CONTRACT_LINKS_FILE, [contract_id, transaction_id], CONTRACT_LINK_HEADERS)
+
+    @staticmethod
+    def stored_links(contracts):
+        """
+        Return {contract_id: [transaction IDs]} as recorded in the contract
+        links table; contracts marked as having no purchases map to []
+        """
+        links = {}
+        rows = Database.find_rows_any(CONTRACT_LINKS_FILE, [{0: contract.contract_id} for contract in contracts])
+        for row in rows:
+            transaction_ids = links.setdefault(row[0], [])
+            if row[1] != NO_PURCHASES:
+                transaction_ids.append(row[1])
+        return links
+
+    def linked_transactions(self, contracts):
+        """
+        Return {contract_id: [transaction IDs]} for contracts. Contracts made
+        before links were recorded are matched once and their links stored.
+        """
+        links = self.stored_links(contracts)
+        unlinked = [contract for contract in contracts if contract.contract_id not in links]
+        if unlinked:
+            for contract_id, transaction_ids in self._match_unlinked(unlinked).items():
+                self.link(contract_id, transaction_ids)
+                links[contract_id] = transaction_ids
+        return links
+
+    @staticmethod
+    def _match_unlinked(contracts, pending_only=True):
+        """
+        Find the purchases of contracts that have no links: the buyer's ledger
+        transactions for the product, made before the contract and not linked
+        to another one, that are pending in transactions.csv, or failing that,
+        pending rows named after the product. With pending_only=False, ledger
+        purchases match whatever their status and there is no fallback.
+        """
+        pairs = {(contract.buyer_id, contract.product_id) for contract in contracts}
+        related = {}  # (buyer, product) -> [(timestamp, ledger transaction ID)]
+        for row in Database.find_rows_any(BLOCKCHAIN_TRANSACTIONS_FILE,
+                                          [{1: buyer_id, 3: product_id} for buyer_id, product_id in pairs]):
+            related.setdefault((row.buyer_id, row.product_id), []).append((row.timestamp, row.transaction_id))
+        transaction_ids = {transaction_id for found in related.values() for _, transaction_id in found}
+        # Purchases settled by another contract are not up for matching
+        transaction_ids -= {row[1] for row in Database.find_rows_any(
+            CONTRACT_LINKS_FILE, [{1: transaction_id} for transaction_id in transaction_ids])}
+        pending_ids = {row[4] for row in Database.find_rows_any(
+            TRANSACTIONS_FILE, [{4: transaction_id} for transaction_id in transaction_ids])
+            if row[3] == "Pending" or not pending_only}
+
+        matched = {}
+        by_product = {}  # Contracts left for the product name fallback
+        for contract in contracts:
+            # A later purchase of the same product belongs to a later contract
+            found = sorted({transaction_id
+                            for timestamp, transaction_id in related.get((contract.buyer_id, contract.product_id), [])
+                            if transaction_id in pending_ids and Reconciler._made_before(timestamp, contract)})
+            if found:
+                matched[contract.contract_id] = found
+            else:
+                by_product.setdefault(contract.product_id, []).append(contract.contract_id)
+        if by_product and pending_only:
+            for row in Database.find_rows_any(TRANSACTIONS_FILE,
+                                              [{1: product_id, 3: "Pending"} for product_id in by_product]):
+                for contract_id in by_product.get(row[1], []):
+                    matched.setdefault(contract_id, []).append(row[4])
+        return matched
+
+    def backfill_links(self, contracts):
+        """
+        Link executed contracts made before links were recorded to the ledger
+        purchases made before them, once. Contracts whose purchases are not
+        found are marked, so they are not matched again. Returns
+        {contract_id: [transaction IDs]} for the contracts given.
+        """
+        matched = self._match_unlinked(contracts, pending_only=False)
+        links = {}
+        with Database.batch():
+            for contract in contracts:
+                transaction_ids = matched.get(contract.contract_id, [])
+                self.link(contract.contract_id, transaction_ids or [NO_PURCHASES])
+                links[contract.contract_id] = transaction_ids
+        return links
+
+    def approve(self, contracts):
+        """Approve the pending transactions.csv rows settled by executed contracts; return those rows"""
+        links = self.linked_transactions(contracts)
+        transaction_ids = {transaction_id for ids in links.values() for transaction_id in ids}
+        if not transaction_ids:
+            return []
+        pending = [row for row in Database.find_rows_any(
+            TRANSACTIONS_FILE, [{4: transaction_id} for transaction_id in transaction_ids]) if row[3] == "Pending"]
+        if pending:
+            Database.update_many(TRANSACTIONS_FILE, [({4: row[4]}, {3: "Approved"}) for row in pending])
+        return pending
+
+    def get_checkpoint(self):
+        """Return the height of the last reconciled block, or -1 if no checkpoint matches the chain"""
+        checkpoint = read_snapshot(self.checkpoint_file)
+        chain = self.blockchain.chain
+        if checkpoint is None:
+            return -1
+        height = checkpoint[0].get("height")
+        if not isinstance(height, int) or not 0 <= height < len(chain):
+            return -1
+        return height if chain[height].hash == checkpoint[0].get("hash") else -1
+
+    def reconcile(self, full=False):
+        """
+        Compare the blocks sealed since the last run (all blocks with full=True)
+        with transactions.csv and the contracts table, then move the checkpoint
+        to the latest block.
+
+        Executed contracts with no recorded links are linked once through
+        backfill_links; one whose purchases are not found is reported as
+        unlinked_contract on that run only. Returns a list of
+        divergences, each {"kind", "id", "detail"}: missing_transaction,
+        amount_mismatch, unknown_contract, contract_not_executed,
+        unlinked_contract or not_approved.
+        """
+        self.blockchain.refresh_chain()
+        chain = self.blockchain.chain
+        start = 0 if full else self.get_checkpoint() + 1
+        purchases = {}  # transaction ID -> sealed amount
+        executions = set()  # IDs of contracts whose execution was sealed
+        for block in chain[start:]:
+            for transaction in block.transactions:
+                if not isinstance(transaction, dict):
+                    continue
+                if transaction.get("type") == "contract_execution" and transaction.get("contract_id"):
+                    executions.add(transaction["contract_id"])
+                elif transaction.get("id") and transaction.get("buyer_id") and not transaction.get("type"):
+                    purchases[transaction["id"]] = transaction.get("amount")
+
+        divergences = []
+        rows = {row[4]: row for row in Database.find_rows_any(
+            TRANSACTIONS_FILE, [{4: transaction_id} for transaction_id in purchases])}
+        for transaction_id, amount in purchases.items():
+            row = rows.get(transaction_id)
+            if row is None:
+                divergences.append({"kind": "missing_transaction", "id": transaction_id,
+                                    "detail": "sealed in a block but not in transactions.csv"})
+            elif not self._same_amount(row[2], amount):
+                divergences.append({"kind": "amount_mismatch", "id": transaction_id,
+                                    "detail": f"transactions.csv has {row[2]}, the block has {amount}"})
+
+        # Contract records carry the same fields as SmartContract objects
+        contracts = Database.find_rows_any(CONTRACTS_FILE, [{0: contract_id} for contract_id in executions])
+        for contract_id in executions - {contract.contract_id for contract in contracts}:
+            divergences.append({"kind": "unknown_contract", "id": contract_id,
+                                "detail": "execution sealed for a contract that is not stored"})
+        for contract in contracts:
+            if contract.status != "Executed":
+                divergences.append({"kind": "contract_not_executed", "id": contract.contract_id,
+                                    "detail": f"execution sealed but the contract is {contract.status}"})
+        links = self.stored_links(contracts) if contracts else {}
+        legacy = [contract for contract in contracts
+                  if contract.contract_id not in links and contract.status == "Executed"]
+        if legacy:
+            backfilled = self.backfill_links(legacy)
+            links.update(backfilled)
+            for contract_id, transaction_ids in backfilled.items():
+                if not transaction_ids:
+                    divergences.append({"kind": "unlinked_contract", "id": contract_id,
+                                        "detail": "execution sealed but no purchase could be linked to it"})
+        linked_ids = {transaction_id for ids in links.values() for transaction_id in ids}
+        for row in Database.find_rows_any(TRANSACTIONS_FILE, [{4: transaction_id} for transaction_id in linked_ids]):
+            if row[3] != "Approved":
+                divergences.append({"kind": "not_approved", "id": row[4],
+                                    "detail": f"its contract was executed but it is {row[3]}"})
+
+        if chain:
+            try:
+                write_snapshot(self.checkpoint_file, {"height": len(chain) - 1, "hash": chain[-1].hash}, [])
+            except OSError as e:
+                print(f"Error saving reconciliation checkpoint: {e}")
+        return divergences
+
+    @staticmethod
+    def _made_before(timestamp, contract):
+        try:
+            return float(timestamp) <= float(contract.creation_time)
+        except (TypeError, ValueError):
+            return True  # Without both times there is nothing to rule it out
+
+    @staticmethod
+    def _same_amount(price, amount):
+        try:
+            return abs(float(price) - float(amount)) <= AMOUNT_TOLERANCE
+        except (TypeError, ValueError):
+            return False
@@ -0,0 +1,81 @@
+import math
+from collections import namedtuple
+
+def to_float(value):
+    """Parse a numeric column, leaving empty or non-numeric values as they are"""
+    if not value:
+        return value
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return number if math.isfinite(number) else value
+
+class TableSchema:
+    """
+    Maps a CSV table to a record type.
+
+    Records are namedtuples, so they take no per-row __dict__ and existing code
+    can keep indexing them by position. Numeric columns are converted once,
+    when the row is parsed. Short rows are padded with "" and columns past the
+    last field are dropped.
+    """
+
+    __slots__ = ("table", "record", "converters", "width")
+
+    def __init__(self, table, record, converters=None):
+        self.table = table
+        self.record = record
+        self.width = len(record._fields)
+        self.converters = [(record._fields.index(field), convert)
+                           for field, convert in (converters or {}).items()]
+
+    def parse(self, row):
+        """Convert a raw CSV row into a record"""
+        values = list(row[:self.width])
+        if len(values) < self.width:
+            values.extend([""] * (self.width - len(values)))
+        for position, convert in self.converters:
+            values[position] = convert(values[position])
+        return self.record._make(values)
+
+UserRecord = namedtuple("UserRecord", ["user_id", "username", "password", "role", "email"])
+LoanRecord = namedtuple("LoanRecord", ["loan_id", "farmer_id", "amount", "interest_rate",
+                                       "application_date", "status", "approval_date", "due_date"])
+RepaymentRecord = namedtuple("RepaymentRecord", ["repayment_id", "loan_id", "amount", "date"])
+ProductRecord = namedtuple("ProductRecord", ["product_id", "farmer_id", "product_name", "price"])
+TransactionRecord = namedtuple("TransactionRecord", ["buyer_name", "product_name", "price",
+                                                     "status", "transaction_id"])
+LedgerTransactionRecord = namedtuple("LedgerTransactionRecord", [
+    "transaction_id", "buyer_id", "seller_id", "product_id",
+    "amount", "timestamp", "status", "block_hash"])
+ContractRecord = namedtuple("ContractRecord", [
+    "contract_id", "buyer_id", "seller_id", "product_id", "price",
+    "terms", "status", "creation_time", "execution_time"])
+ResourceRecord = namedtuple("ResourceRecord", ["resource_id", "title", "category", "content",
+                                               "tags", "date_added"])
+
+# Table name -> schema used by Database to turn rows into records
+SCHEMAS = {}
+
+def register_schema(schema):
+    """Add or replace the schema for a table"""
+    SCHEMAS[schema.table] = schema
+    return schema
+
+def get_schema(table):
+    """Return the schema for a table, or None if its rows stay plain lists"""
+    return SCHEMAS.get(table)
+
+register_schema(TableSchema("users.csv", UserRecord))
+register_schema(TableSchema("loans.csv", LoanRecord,
+                            {"amount": to_float, "interest_rate": to_float}))
+register_schema(TableSchema("loan_repayments.csv", RepaymentRecord, {"amount": to_float}))
+register_schema(TableSchema("marketplace.csv", ProductRecord, {"price": to_float}))
+register_schema(TableSchema("transactions.csv", TransactionRecord, {"price": to_float}))
+register_schema(TableSchema("blockchain_transactions.csv", LedgerTransactionRecord,
+                            {"amount": to_float, "timestamp": to_float}))
+register_schema(TableSchema("smart_contracts.csv", ContractRecord,
+                            {"price": to_float, "creation_time": to_float,
+                             "execution_time": to_float}))
+register_schema(TableSchema("educational_resources.csv", ResourceRecord))
@@ -0,0 +1,64 @@
+import marshal
+import os
+import struct
+
+# File layout: header, then length-prefixed marshal chunks. The first chunk
+# holds the metadata dict and every later one a list of records.
+SNAPSHOT_MAGIC = b"FGSN"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_CHUNK_RECORDS = 4096
+
+_HEADER = struct.Struct("<4sH")
+_LENGTH = struct.Struct("<I")
+
+def write_snapshot(path, meta, records):
+    """
+    Write meta (a dict) and records to a snapshot file.
+
+    Records must be built from types marshal supports (tuples, lists, dicts,
+    strings, numbers, None). The file is written next to its final name and
+    renamed into place, so readers never see a partial snapshot.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, mode='wb') as file:
+        file.write(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION))
+        chunks = [meta] + [records[start:start + SNAPSHOT_CHUNK_RECORDS]
+                           for start in range(0, len(records), SNAPSHOT_CHUNK_RECORDS)]
+        for chunk in chunks:
+            data = marshal.dumps(chunk)
+            file.write(_LENGTH.pack(len(data)))
+            file.write(data)
+    os.replace(temp_path, path)
+
+def read_snapshot(path):
+    """Return (meta, records) from a snapshot file, or None if it is missing or unreadable"""
+    try:
+        with open(path, mode='rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+    if len(data) < _HEADER.size or _HEADER.unpack_from(data) != (SNAPSHOT_MAGIC, SNAPSHOT_VERSION):
+        return None
+    chunks = []
+    offset = _HEADER.size
+    try:
+        while offset < len(data):
+            (length,) = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            if offset + length > len(data):
+                return None  # Truncated file
+            chunks.append(marshal.loads(data[offset:offset + length]))
+            offset += length
+    except (struct.error, EOFError, ValueError, TypeError):
+        return None
+    if not chunks or not isinstance(chunks[0], dict):
+        return None
+    records = []
+    for chunk in chunks[1:]:
+        records.extend(chunk)
+    return chunks[0], records
+
+def remove_snapshot(path):
+    """Delete a snapshot file if it exists"""
+    if os.path.isfile(path):
+        os.remove(path)
@@ -0,0 +1,1596 @@
+import csv
+import io
+import json
+import mmap
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import groupby
+from snapshot import read_snapshot, remove_snapshot, write_snapshot
+
+DATA_FOLDER = "data"
+if not os.path.exists(DATA_FOLDER):
+    os.makedirs(DATA_FOLDER)
+
+# Storage engine used by Database: "csv" (the files in DATA_FOLDER) or "sqlite"
+STORAGE_ENGINE = "csv"
+SQLITE_FILE = os.path.join(DATA_FOLDER, "farmgate.db")
+
+# Upper bound on the bytes of CSV data kept parsed in memory by the table cache
+TABLE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Size at which a table's update log is folded back into its CSV file
+LOG_COMPACT_BYTES = 256 * 1024
+
+# Encoding of the CSV files; byte offsets in the key index depend on it
+ENCODING = "utf-8"
+
+# Rows fetched per round trip when streaming a SQLite table
+ITER_CHUNK_ROWS = 256
+# Filters ORed together in one SQLite query
+SQLITE_MAX_OR_CLAUSES = 200
+# A cold load that parses at least this many bytes past the last snapshot
+# writes a new one, so the next process start only parses what came after it
+SNAPSHOT_MIN_BYTES = 64 * 1024
+SNAPSHOT_FINGERPRINT_BYTES = 64
+
+# Position of the ID column of each table, used for primary key lookups
+TABLE_KEYS = {
+    "users.csv": 0,
+    "farmers.csv": 0,
+    "buyers.csv": 0,
+    "marketplace.csv": 0,
+    "loans.csv": 0,
+    "loan_repayments.csv": 0,
+    "transactions.csv": 4,
+    "blockchain.csv": 0,
+    "blockchain_transactions.csv": 0,
+    "smart_contracts.csv": 0,
+    "educational_resources.csv": 0,
+    "transaction_index.csv": 0,
+}
+
+# Table name -> columns with a secondary index, for filters on foreign keys and
+# status columns. Both engines maintain them as rows are written.
+TABLE_INDEXES = {
+    "loans.csv": (1, 5),  # farmer_id, status
+    "loan_repayments.csv": (1,),  # loan_id
+    "blockchain_transactions.csv": (1, 2),  # buyer_id, seller_id
+    "smart_contracts.csv": (1, 2, 6),  # buyer_id, seller_id, status
+    "contract_events.csv": (0,),  # contract_id
+    "contract_links.csv": (0, 1),  # contract_id, transaction_id
+}
+
+# Table name -> (date column, "epoch" or "date"). The CSV engine stores these
+# tables as one file per month under DATA_FOLDER/<table name without .csv>/,
+# listed in a manifest.json next to them.
+TABLE_PARTITIONS = {
+    "blockchain_transactions.csv": (5, "epoch"),  # timestamp
+    "loan_repayments.csv": (3, "date"),  # date
+}
+UNDATED_PARTITION = "undated"  # Rows whose date column cannot be read
+
+def partition_month(value, kind):
+    """Return the "YYYY-MM" month a date column value falls in, or None; epoch values are read as UTC"""
+    if kind == "epoch":
+        try:
+            return time.strftime("%Y-%m", time.gmtime(float(value)))
+        except (TypeError, ValueError, OverflowError, OSError):
+            return None
+    found = re.match(r"(\d{4}-\d{2})", str(value or ""))
+    return found.group(1) if found else None
+
+def row_month(table, row):
+    """Return the month a row of a partitioned table belongs to, or None"""
+    column, kind = TABLE_PARTITIONS[table]
+    return partition_month(row[column], kind) if len(row) > column else None
+
+def in_period(month, first_month=None, last_month=None):
+    """Check a "YYYY-MM" month against an inclusive range; None bounds are open"""
+    if month is None:
+        return first_month is None and last_month is None
+    return (first_month is None or month >= first_month) and (last_month is None or month <= last_month)
+
+def logical_table(table):
+    """Return the table a partition file belongs to ("loan_repayments/2025-03.csv" -> "loan_repayments.csv")"""
+    folder = os.path.dirname(table)
+    return folder + ".csv" if folder else table
+
+def indexed_columns(table):
+    """Return the columns of a table that have an index, ID column first"""
+    table = logical_table(table)
+    columns = [TABLE_KEYS[table]] if table in TABLE_KEYS else []
+    columns += [column for column in TABLE_INDEXES.get(table, ()) if column not in columns]
+    return columns
+
+def row_matches(row, match):
+    """Check a row against a {column index: value} equality filter"""
+    for column, value in match.items():
+        if len(row) <= column or row[column] != value:
+            return False
+    return True
+
+def apply_changes(row, changes):
+    """Return a copy of row with {column index: value} changes applied"""
+    row = list(row)
+    width = max(changes) + 1 if changes else 0
+    while len(row) < width:
+        row.append("")  # Pad short rows, as the loan updates always did
+    for column, value in changes.items():
+        row[column] = "" if value is None else str(value)
+    return tuple(row)
+
+def encode_rows(rows):
+    """Serialize rows the way csv.writer does; return a list of encoded records"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    encoded = []
+    for row in rows:
+        writer.writerow(row)
+        encoded.append(buffer.getvalue().encode(ENCODING))
+        buffer.seek(0)
+        buffer.truncate()
+    return encoded
+
+def iter_records(source, offset=0):
+    """
+    Yield (row, start, end) for each CSV record of a binary file or mmap.
+
+    Parsing starts at byte offset. csv.reader pulls one line at a time and only
+    asks for more inside quoted fields, so the bytes consumed so far always end
+    at a record boundary.
+    """
+    source.seek(offset)
+    consumed = [offset]
+
+    def lines():
+        while True:
+            line = source.readline()
+            if not line:
+                return
+            consumed[0] += len(line)
+            yield line.decode(ENCODING)
+
+    start = offset
+    for row in csv.reader(lines()):
+        yield tuple(row), start, consumed[0]
+        start = consumed[0]
+
+class TableIndex:
+    """
+    Persistent map from a table's indexed columns to the byte offsets of its rows.
+
+    The sidecar file ("<table>.idx") starts with the inode of the CSV file it
+    describes and the indexed columns, followed by one "offset,end,values..."
+    line per CSV record, so line N describes record N. Rows appended to the CSV
+    file are added to the end of the sidecar, and a lookup parses only the
+    bytes of the matching rows from an mmap of the CSV file.
+
+    The index describes the rows as written to the CSV file; changes held in
+    the update log are merged in by CSVBackend.
+    """
+
+    def __init__(self, csv_path, columns):
+        self.csv_path = csv_path
+        self.path = csv_path + ".idx"
+        self.columns = tuple(columns)
+        self.inode = None
+        self.mtime = None  # Modification time of the CSV file when the index last covered all of it
+        self.end = 0  # Bytes of the CSV file covered by the index
+        self.count = 0  # Records covered by the index
+        self.offsets = {}  # column -> {value: [(offset, record number), ...]}
+        self._lock = threading.RLock()
+
+    def _reset(self, inode=None):
+        self.inode = inode
+        self.mtime = None
+        self.offsets = {column: {} for column in self.columns}
+        self.end, self.count = 0, 0
+
+    def _insert(self, start, values):
+        if self.count:  # Record 0 is the header
+            # Empty values are indexed too, so filters on "" are answered like any other
+            for column, value in zip(self.columns, values):
+                self.offsets[column].setdefault(value, []).append((start, self.count))
+        self.count += 1
+
+    def _add(self, row, start, end, lines):
+        values = [row[column] if len(row) > column and self.count else "" for column in self.columns]
+        self._insert(start, values)
+        lines.append([start, end] + values)
+        self.end = end
+
+    def _write(self, lines, reset=False):
+        with open(self.path, mode='w' if reset else 'a', newline='', encoding=ENCODING) as file:
+            writer = csv.writer(file)
+            if reset:
+                writer.writerow([self.inode] + list(self.columns))
+            writer.writerows(lines)
+
+    def _load(self, inode):
+        """Read the sidecar; return False if it is missing or describes another file"""
+        self._reset(inode)
+        width = len(self.columns) + 2
+        try:
+            with open(self.path, mode='r+b') as file:
+                data = file.read()
+                lines = iter_records(io.BytesIO(data))
+                header = next(lines, None)
+                if header is None or header[0] != (str(inode),) + tuple(str(column) for column in self.columns):
+                    return False
+                good = header[2]
+                for line, _, end in lines:
+                    # A line cut short can still have the right number of
+                    # fields, so only lines that were finished count
+                    if len(line) != width or not data[:end].endswith(b"\n"):
+                        break  # Torn write; the rest is rebuilt from the CSV file
+                    self._insert(int(line[0]), list(line[2:]))
+                    self.end = int(line[1])
+                    good = end
+                if good < len(data):
+                    file.truncate(good)  # So lines appended later follow the last good one
+        except (OSError, ValueError, UnicodeDecodeError, csv.Error):
+            return False
+        return True
+
+    def _scan(self, reset):
+        """Index the CSV records past self.end"""
+        lines = []
+        with open(self.csv_path, mode='rb') as file:
+            for row, start, end in iter_records(file, self.end):
+                self._add(row, start, end, lines)
+        if lines or reset:
+            self._write(lines, reset)
+
+    def refresh(self):
+        """Bring the index in line with the CSV file, scanning only what is new"""
+        with self._lock:
+            try:
+                stat = os.stat(self.csv_path)
+            except OSError:
+                self._reset()
+                return
+            # A rewrite can reuse the inode and the size of the file it
+            # replaced, so a file that changed without growing is rebuilt
+            rewritten = stat.st_size == self.end and stat.st_mtime_ns != self.mtime
+            if stat.st_ino != self.inode or stat.st_size < self.end or rewritten:
+                if rewritten or not self._load(stat.st_ino) or stat.st_size < self.end:
+                    self._reset(stat.st_ino)
+                    self._scan(reset=True)
+            if stat.st_size > self.end:
+                self._scan(reset=False)
+            self._stamp()
+
+    def _stamp(self):
+        """Remember the modification time of the CSV file if the index covers all of it"""
+        try:
+            stat = os.stat(self.csv_path)
+        except OSError:
+            stat = None
+        self.mtime = stat.st_mtime_ns if stat is not None and stat.st_size == self.end else None
+
+    def invalidate(self):
+        """Throw the index away; it is rebuilt from the CSV file when next used"""
+        with self._lock:
+            self._reset()
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+
+    def extend(self, start, records):
+        """Record rows just appended at byte offset start, given as (row, encoded bytes)"""
+        with self._lock:
+            if self.inode is None or self.end != start:
+                return  # Not loaded or behind; refresh() will scan the new rows
+            lines = []
+            for row, data in records:
+                self._add(row, start, start + len(data), lines)
+                start += len(data)
+            self._write(lines)
+            self._stamp()
+
+    def locate(self, column, values):
+        """Return {record number: (offset, column, value)} for the CSV records whose column holds one of values"""
+        with self._lock:
+            self.refresh()
+            return {position: (start, column, value) for value in values
+                    for start, position in self.offsets[column].get(value, [])}
+
+    def read(self, locations):
+        """
+        Yield (record number, row) for locations returned by locate(), in
+        record order, parsing only those records. A record whose column no
+        longer holds the value it was indexed under means the offsets are
+        stale; it is yielded with row None. Records too short to have the
+        column are indexed as "" but match nothing, so they are skipped.
+        """
+        if not locations:
+            return
+        with open(self.csv_path, mode='rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                for position in sorted(locations):
+                    start, column, value = locations[position]
+                    row = next(iter_records(view, start), (None,))[0]
+                    if row is not None and len(row) <= column and value == "":
+                        continue
+                    if row is None or len(row) <= column or row[column] != value:
+                        row = None
+                    yield position, row
+
+class TableCache:
+    """Process-wide cache of parsed CSV tables, keyed by file path.
+
+    An entry stays valid while the signature of its files (mtime and size) is
+    unchanged. Least recently used entries are dropped once the cached file
+    sizes add up to more than max_bytes. Data derived from an entry, such as
+    typed records, is kept with it, counts as much again and goes with it.
+    """
+
+    def __init__(self, max_bytes=TABLE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # path -> (signature, value, size, derived value or None)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(file_path):
+        """Return the (mtime, size) pair that identifies a version of the file"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, file_path, signature):
+        """Return the value cached for a file, or None if missing or stale"""
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is None:
+                return None
+            if entry[0] != signature:
+                self._drop(file_path)
+                return None
+            self._entries.move_to_end(file_path)
+            return entry[1]
+
+    def put(self, file_path, signature, value, size):
+        """Store the parsed value for the file version identified by signature"""
+        with self._lock:
+            self._drop(file_path)
+            if size > self.max_bytes:
+                return
+            self._entries[file_path] = (signature, value, size, None)
+            self._bytes += size
+            self._evict()
+
+    def derive(self, file_path, value, build):
+        """
+        Return build(), kept with the entry caching value for a file so later
+        calls reuse it until the entry is replaced or dropped
+        """
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None and entry[1] is value and entry[3] is not None:
+                self._entries.move_to_end(file_path)
+                return entry[3]
+        derived = build()  # Built without the lock; it can take a while
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if (entry is not None and entry[1] is value and entry[3] is None
+                    and 2 * entry[2] <= self.max_bytes):
+                self._entries[file_path] = entry[:3] + (derived,)
+                self._entries.move_to_end(file_path)
+                self._bytes += entry[2]
+                self._evict()
+        return derived
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+
+    def invalidate(self, file_path=None):
+        """Drop one file from the cache, or everything if no path is given"""
+        with self._lock:
+            if file_path is None:
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                self._drop(file_path)
+
+    def _drop(self, file_path):
+        entry = self._entries.pop(file_path, None)
+        if entry is not None:
+            self._bytes -= entry[2] if entry[3] is None else 2 * entry[2]
+
+table_cache = TableCache()
+
+class StorageBackend:
+    """
+    Interface implemented by the engines that persist FarmGate tables.
+
+    Tables are named after their CSV file (e.g. "loans.csv"). The first row of a
+    table is its header. Rows are sequences of strings and columns are addressed
+    by position, so every engine exposes the same layout the CSV files have.
+    Filters and updates are {column index: value} dictionaries.
+    """
+
+    def table_exists(self, table):
+        raise NotImplementedError
+
+    def create_table(self, table, headers):
+        """Create an empty table with the given headers if it does not exist"""
+        raise NotImplementedError
+
+    def read_table(self, table):
+        """Return all rows as tuples, header first ([] if the table is missing)"""
+        raise NotImplementedError
+
+    def append_rows(self, table, rows, headers, sync=False):
+        """Append rows, writing the headers first if the table is new.
+
+        With sync=True the rows are on disk when the call returns.
+        """
+        raise NotImplementedError
+
+    def replace_table(self, table, rows):
+        """Replace the whole table, header row included"""
+        raise NotImplementedError
+
+    def derived(self, table, rows, build):
+        """
+        Return build(rows) for rows just returned by read_table. Engines that
+        cache rows keep the result with them, so it is built again only when
+        the table changes.
+        """
+        return build(rows)
+
+    def iter_rows(self, table, match=None):
+        """Yield the header, then the data rows matching match, without loading the table"""
+        raise NotImplementedError
+
+    def find_rows(self, table, match, limit=None):
+        """Return data rows matching every {column: value} pair"""
+        raise NotImplementedError
+
+    def iter_period(self, table, first_month=None, last_month=None, match=None):
+        """
+        Yield the header, then the data rows dated within an inclusive range of
+        "YYYY-MM" months. Only tables listed in TABLE_PARTITIONS have a date.
+        """
+        if table not in TABLE_PARTITIONS:
+            raise ValueError(f"{table} is not partitioned by date")
+        rows = self.iter_rows(table, match)
+        header = next(rows, None)
+        if header is None:
+            return
+        yield header
+        for row in rows:
+            if in_period(row_month(table, row), first_month, last_month):
+                yield row
+
+    def find_rows_any(self, table, matches):
+        """Return data rows matching at least one of the filters, in table order"""
+        return [row for row in self.read_table(table)[1:]
+                if any(row_matches(row, match) for match in matches)]
+
+    def update_rows(self, table, match, changes):
+        """Apply {column: value} changes to matching rows; return the count"""
+        raise NotImplementedError
+
+    def update_many(self, table, updates):
+        """Apply a list of (match, changes) updates in order; return the total count"""
+        return sum(self.update_rows(table, match, changes) for match, changes in updates)
+
+    def delete_rows(self, table, match):
+        """Delete matching rows; return the count"""
+        raise NotImplementedError
+
+class CSVBackend(StorageBackend):
+    """
+    Stores each table as a CSV file in DATA_FOLDER.
+
+    Row updates and deletions are not written into the CSV file. They are
+    appended as JSON records to an update log next to it ("<table>.log") and
+    merged into the rows on read. Once a log grows past compact_bytes, a
+    background thread folds it back into the CSV file.
+
+    Tables with an ID column (TABLE_KEYS) or secondary indexes (TABLE_INDEXES)
+    get a TableIndex, so filters on those columns read only the matching rows.
+
+    Tables in TABLE_PARTITIONS are split into one CSV table per month. Each
+    partition has its own cache entry, log, index and snapshot, so months
+    that are over stay cached while the current one grows.
+    """
+
+    def __init__(self, data_folder=DATA_FOLDER, cache=table_cache, compact_bytes=LOG_COMPACT_BYTES):
+        self.data_folder = data_folder
+        self.cache = cache
+        self.compact_bytes = compact_bytes
+        self._lock = threading.RLock()
+        self._compacting = set()
+        self._indexes = {}  # table -> TableIndex
+        self._log_entries = {}  # table -> (log signature, parsed log records)
+        self._manifests = {}  # partitioned table -> (manifest signature, manifest)
+        # partitioned table -> [partition rows, concatenated rows, (derived parts, derived rows), partitions]
+        self._merged = {}
+
+    def path(self, table):
+        return os.path.join(self.data_folder, table)
+
+    def log_path(self, table):
+        return self.path(table) + ".log"
+
+    def snapshot_path(self, table):
+        return self.path(table) + ".snap"
+
+    def _fingerprint(self, file, end):
+        """Return the bytes just before end, used to tell whether a snapshot still fits the file"""
+        file.seek(max(0, end - SNAPSHOT_FINGERPRINT_BYTES))
+        return file.read(min(end, SNAPSHOT_FINGERPRINT_BYTES))
+
+    def _checkpoint(self, table, rows, inode, end, file):
+        """Snapshot the CSV rows that make up the first end bytes of the file"""
+        meta = {"inode": inode, "end": end, "fingerprint": self._fingerprint(file, end)}
+        try:
+            write_snapshot(self.snapshot_path(table), meta, rows)
+        except OSError:
+            pass  # A missing snapshot only costs a full parse on the next start
+
+    def _read_base(self, table):
+        """
+        Return the rows stored in a table's CSV file, without the log applied.
+
+        Rows covered by the table's snapshot are taken from it and only the
+        bytes appended since then are parsed.
+        """
+        with open(self.path(table), mode='rb') as file:
+            inode = os.fstat(file.fileno()).st_ino
+            size = os.fstat(file.fileno()).st_size
+            rows, start = [], 0
+            snapshot = read_snapshot(self.snapshot_path(table))
+            if snapshot is not None:
+                meta, records = snapshot
+                end = meta.get("end", -1)
+                if (meta.get("inode") == inode and 0 <= end <= size
+                        and self._fingerprint(file, end) == meta.get("fingerprint")):
+                    rows, start = records, end
+            file.seek(start)
+            tail = file.read()
+            rows.extend(tuple(row) for row in csv.reader(io.StringIO(tail.decode(ENCODING), newline='')))
+            # Only snapshot whole records; a concurrent writer may be mid-row
+            if len(tail) >= SNAPSHOT_MIN_BYTES and tail.endswith(b"\n"):
+                self._checkpoint(table, rows, inode, start + len(tail), file)
+        return rows
+
+    def _signature(self, table):
+        return (TableCache.signature(self.path(table)), TableCache.signature(self.log_path(table)))
+
+    @staticmethod
+    def _cost(signature):
+        return sum(part[1] for part in signature if part)
+
+    def _load(self, table):
+        """
+        Return (rows, positions, base_count) for a table with its log applied.
+
+        positions holds the record number of each row in the CSV file and base_count is
+        the number of rows in the file, so log records only touch rows that
+        existed when they were written.
+        """
+        file_path = self.path(table)
+        # Held while reading, so a compaction cannot swap the file and drop
+        # the log between the two reads
+        with self._lock:
+            signature = self._signature(table)
+            state = self.cache.get(file_path, signature)
+            if state is not None:
+                return state
+
+            rows = self._read_base(table)
+            positions = list(range(len(rows)))
+            base_count = len(rows)
+            rows, positions, _ = self._apply_entries(rows, positions, self._read_log(table))
+            state = (rows, positions, base_count)
+            self.cache.put(file_path, signature, state, self._cost(signature))
+            return state
+
+    def _index(self, table):
+        """Return the row index of a table, or None if none of its columns are indexed"""
+        columns = indexed_columns(table)
+        if not columns:
+            return None
+        index = self._indexes.get(table)
+        if index is None:
+            index = self._indexes[table] = TableIndex(self.path(table), columns)
+        return index
+
+    def _parsed_log(self, table):
+        """Return the parsed log records of a table, re-reading the log only when it changes"""
+        with self._lock:
+            signature = self._signature(table)
+            cached = self._log_entries.get(table)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+            entries = [self._parse_entry(entry) for entry in self._read_log(table)]
+            self._log_entries[table] = (signature, entries)
+            return entries
+
+    def _lookup(self, table, matches, limit=None):
+        """
+        Return the rows matching any of the filters, in table order, using the
+        row index; with a limit, stop once that many are found. Returns None
+        when a filter has no indexed column, so the caller has to scan instead.
+        """
+        found = self._locate(table, matches, limit)
+        return None if found is None else [row for _, row in found]
+
+    def _locate(self, table, matches, limit=None):
+        """Like _lookup, but return (record number, row) pairs"""
+        # Held so a compaction cannot replace the file between the index
+        # lookup and the log replay
+        with self._lock:
+            index = self._index(table)
+            if index is None or not os.path.isfile(self.path(table)):
+                return None
+            entries = self._parsed_log(table)
+            rewritten = {column for _, _, _, changes in entries for column in changes}
+            wanted = {}  # column -> values whose rows are candidates
+            for match in matches:
+                column = next((column for column in index.columns if column in match), None)
+                if column is None:
+                    return None
+                wanted.setdefault(column, set()).add(match[column])
+                if column in rewritten:
+                    # Logged updates may have moved rows into this value; their own
+                    # filters find them, as long as those filter on a stable column
+                    for _, _, entry_match, changes in entries:
+                        if column not in changes:
+                            continue
+                        stable = next((other for other in index.columns
+                                       if other in entry_match and other not in rewritten), None)
+                        if stable is None:
+                            return None
+                        wanted.setdefault(stable, set()).add(entry_match[stable])
+            for _ in range(2):
+                locations = {}
+                for column, values in wanted.items():
+                    locations.update(index.locate(column, values))
+                found = []
+                for position, row in index.read(locations):
+                    if row is None:
+                        break  # Stale offsets
+                    row = self._replay_row(row, position, entries)
+                    if row is not None and any(row_matches(row, match) for match in matches):
+                        found.append((position, row))
+                        if limit is not None and len(found) >= limit:
+                            return found
+                else:
+                    return found
+                index.invalidate()  # Rebuilt from the CSV file by the next locate()
+            return []
+
+    def _read_log(self, table):
+        """Return the log records that belong to the current CSV file"""
+        entries = []
+        try:
+            base_id = os.stat(self.path(table)).st_ino
+            with open(self.log_path(table), mode='r') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn write at the end of the log
+                    # Records left over from before a compaction describe an older file
+                    if entry.get("base") == base_id:
+                        entries.append(entry)
+        except FileNotFoundError:
+            return []  # No log, or a compaction just folded it in
+        return entries
+
+    @staticmethod
+    def _parse_entry(entry):
+        """Return (op, row limit, match, changes) with integer column keys"""
+        return (
+            entry["op"],
+            entry["rows"],
+            {int(column): value for column, value in entry["match"].items()},
+            {int(column): value for column, value in entry.get("set", {}).items()},
+        )
+
+    @staticmethod
+    def _replay_row(row, position, entries):
+        """Apply parsed log records to one CSV row; None means it was deleted"""
+        for op, limit, match, changes in entries:
+            if position < limit and row_matches(row, match):
+                if op == "delete":
+                    return None
+                row = apply_changes(row, changes)
+        return row
+
+    @staticmethod
+    def _apply_entry(rows, positions, entry):
+        """Apply one log record; return the new rows, positions and affected count"""
+        if not rows:
+            return rows, positions, 0
+        match = {int(column): value for column, value in entry["match"].items()}
+        limit = entry["rows"]
+        changes = {int(column): value for column, value in entry.get("set", {}).items()}
+        new_rows, new_positions = [rows[0]], [positions[0]]
+        count = 0
+        for row, position in zip(rows[1:], positions[1:]):
+            if position < limit and row_matches(row, match):
+                count += 1
+                if entry["op"] == "delete":
+                    continue
+                row = apply_changes(row, changes)
+            new_rows.append(row)
+            new_positions.append(position)
+        return new_rows, new_positions, count
+
+    @staticmethod
+    def _keyed_run(entries, start):
+        """
+        Return where the run of log records from start ends that can be applied
+        in one pass: updates with the same row limit, each matching one value
+        of the same column and leaving that column alone.
+        """
+        column = limit = None
+        end = start
+        for entry in entries[start:]:
+            match = entry["match"]
+            if entry["op"] != "update" or len(match) != 1:
+                break
+            entry_column = int(next(iter(match)))
+            if column is None:
+                column, limit = entry_column, entry["rows"]
+            if (entry_column != column or entry["rows"] != limit
+                    or column in {int(changed) for changed in entry.get("set", {})}):
+                break
+            end += 1
+        return end
+
+    @staticmethod
+    def _apply_keyed(rows, positions, entries):
+        """Apply a run found by _keyed_run with one pass over the rows; return rows, positions and counts"""
+        column = int(next(iter(entries[0]["match"])))
+        limit = entries[0]["rows"]
+        by_value = {}  # matched value -> [(record number, changes)] in log order
+        for number, entry in enumerate(entries):
+            changes = {int(changed): value for changed, value in entry.get("set", {}).items()}
+            by_value.setdefault(next(iter(entry["match"].values())), []).append((number, changes))
+        counts = [0] * len(entries)
+        new_rows = [rows[0]]
+        for row, position in zip(rows[1:], positions[1:]):
+            if position < limit and len(row) > column and row[column] in by_value:
+                for number, changes in by_value[row[column]]:
+                    counts[number] += 1
+                    row = apply_changes(row, changes)
+            new_rows.append(row)
+        return new_rows, positions, counts
+
+    @classmethod
+    def _apply_entries(cls, rows, positions, entries):
+        """
+        Apply log records in order; return the new rows, positions and the
+        count of each. Runs of updates keyed on one column, such as status
+        changes by ID, take one pass over the rows instead of one per record.
+        """
+        counts = []
+        start = 0
+        while start < len(entries):
+            end = cls._keyed_run(entries, start)
+            if end - start > 1:
+                rows, positions, run_counts = cls._apply_keyed(rows, positions, entries[start:end])
+                counts.extend(run_counts)
+            else:
+                end = start + 1
+                rows, positions, count = cls._apply_entry(rows, positions, entries[start])
+                counts.append(count)
+            start = end
+        return rows, positions, counts
+
+    def _log(self, table, entry):
+        """Append a record to the update log and apply it to the cached rows"""
+        return self._log_many(table, [entry])
+
+    def _log_many(self, table, entries):
+        """
+        Append records to the update log in one write; return the rows affected.
+
+        When every filter is on an indexed column, only the rows they match are
+        read, through the row index, and the cached rows are patched only if
+        the table is cached already. Otherwise the table is loaded.
+        """
+        with self._lock:
+            changed = self._index_changes(table, entries)
+            if changed is None:
+                return self._log_loaded(table, entries)
+            counts, changed = changed
+            logged = [entry for entry, count in zip(entries, counts) if count]
+            if not logged:
+                return 0
+            state = self.cache.get(self.path(table), self._signature(table))
+            self._append_log(table, logged)
+            if state is not None:
+                self._cache_state(table, self._patch_state(state, changed))
+            return sum(counts)
+
+    def _index_changes(self, table, entries):
+        """
+        Stamp log records for the current CSV file and work out what they do to
+        the rows found through the row index. Returns (count of each record,
+        {record number: new row, or None if deleted}), or None if a filter has
+        no indexed column.
+        """
+        index = self._index(table)
+        if index is None:
+            return None
+        found = self._locate(table, [entry["match"] for entry in entries])
+        if found is None:
+            return None
+        with index._lock:
+            index.refresh()
+            base_count = index.count
+        if not base_count:
+            return [0] * len(entries), {}
+        self._stamp(table, entries, base_count)
+        # Rows a record changes either match its filter now or were changed
+        # by an earlier record, so the found rows are all the records touch
+        before = dict(found)
+        positions = [0] + [position for position, _ in found]
+        rows, positions, counts = self._apply_entries([()] + [row for _, row in found], positions, entries)
+        after = dict(zip(positions[1:], rows[1:]))
+        return counts, {position: after.get(position) for position, row in before.items()
+                        if after.get(position) != row}
+
+    def _stamp(self, table, entries, base_count):
+        """Tie log records to the current CSV file and the rows it holds"""
+        base_id = os.stat(self.path(table)).st_ino
+        for entry in entries:
+            entry["base"] = base_id
+            entry["rows"] = base_count
+
+    @staticmethod
+    def _patch_state(state, changed):
+        """Return a copy of a cached (rows, positions, base_count) with changed rows replaced or removed"""
+        rows, positions, base_count = state
+        rows = list(rows)
+        for position, row in changed.items():
+            number = bisect_left(positions, position)
+            if number < len(positions) and positions[number] == position:
+                rows[number] = row
+        if None in changed.values():
+            kept = [number for number, row in enumerate(rows) if row is not None]
+            rows = [rows[number] for number in kept]
+            positions = [positions[number] for number in kept]
+        return rows, positions, base_count
+
+    def _log_loaded(self, table, entries):
+        """Apply log records to the loaded table, for filters the row index cannot answer"""
+        rows, positions, base_count = self._load(table)
+        if not rows:
+            return 0
+        self._stamp(table, entries, base_count)
+        rows, positions, counts = self._apply_entries(rows, positions, entries)
+        # Records that matched nothing would match nothing on replay either
+        logged = [entry for entry, count in zip(entries, counts) if count]
+        if not logged:
+            return 0
+        self._append_log(table, logged)
+        self._cache_state(table, (rows, positions, base_count))
+        return sum(counts)
+
+    def _append_log(self, table, entries):
+        cached = self._log_entries.get(table)
+        fresh = cached is not None and cached[0] == self._signature(table)
+        with open(self.log_path(table), mode='a') as file:
+            file.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        if fresh:
+            # Keep the parsed log in step instead of reading it again
+            self._log_entries[table] = (self._signature(table),
+                                        cached[1] + [self._parse_entry(entry) for entry in entries])
+        self._schedule_compaction(table)
+
+    def _cache_state(self, table, state):
+        signature = self._signature(table)
+        self.cache.put(self.path(table), signature, state, self._cost(signature))
+
+    def _schedule_compaction(self, table):
+        if table in self._compacting:
+            return
+        try:
+            if os.path.getsize(self.log_path(table)) < self.compact_bytes:
+                return
+        except OSError:
+            return
+        self._compacting.add(table)
+        # Not a daemon thread, so a compaction in progress finishes before exit
+        threading.Thread(target=self.compact, args=(table,), name=f"compact-{table}").start()
+
+    def compact(self, table):
+        """Fold the update log of a table back into its CSV file"""
+        try:
+            with self._lock:
+                if not os.path.isfile(self.log_path(table)):
+                    return
+                rows = self._load(table)[0]
+                temp_path = self.path(table) + ".tmp"
+                with open(temp_path, mode='w', newline='', encoding=ENCODING) as file:
+                    csv.writer(file).writerows(rows)
+                # The compacted file is a checkpoint: snapshot it for the next cold start
+                with open(temp_path, mode='rb') as file:
+                    stat = os.fstat(file.fileno())
+                    self._checkpoint(table, rows, stat.st_ino, stat.st_size, file)
+                # The new file has a new inode, so stale log records are ignored
+                # even if we stop before the log is removed
+                os.replace(temp_path, self.path(table))
+                os.remove(self.log_path(table))
+                self.cache.invalidate(self.path(table))
+                if self._index(table):
+                    self._index(table).invalidate()
+        finally:
+            self._compacting.discard(table)
+
+    def partition_folder(self, table):
+        return os.path.join(self.data_folder, os.path.splitext(table)[0])
+
+    def manifest_path(self, table):
+        return os.path.join(self.partition_folder(table), "manifest.json")
+
+    @staticmethod
+    def partition_table(table, month):
+        """Return the name of the CSV table holding one month of a partitioned table"""
+        return f"{os.path.splitext(table)[0]}/{month}.csv"
+
+    def _manifest(self, table):
+        """
+        Return the manifest of a partitioned table, or None if it does not exist.
+
+        The manifest lists the table's headers and its partitions by month. A
+        table still stored as a single CSV file is split into months first.
+        """
+        path = self.manifest_path(table)
+        signature = TableCache.signature(path)
+        if signature is None:
+            if not os.path.isfile(self.path(table)):
+                return None
+            return self._migrate(table)
+        cached = self._manifests.get(table)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        with open(path, mode='r', encoding=ENCODING) as file:
+            manifest = json.load(file)
+        self._manifests[table] = (signature, manifest)
+        return manifest
+
+    def _save_manifest(self, table, manifest):
+        path = self.manifest_path(table)
+        os.makedirs(self.partition_folder(table), exist_ok=True)
+        # Each writer has its own temporary file, so processes creating the
+        # same table at once do not rename one another's file away
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, mode='w', encoding=ENCODING) as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+        os.replace(temp_path, path)
+        self._manifests[table] = (TableCache.signature(path), manifest)
+
+    def _migrate(self, table):
+        """
+        Split a table stored as one CSV file into monthly partitions.
+
+        The CSV file and its log are left where they are, so a checked-out data
+        folder stays unchanged; once the manifest exists they are not read.
+        """
+        with self._lock:
+            rows = self._load(table)[0]
+            # Partition files without a manifest are left over from an interrupted migration
+            shutil.rmtree(self.partition_folder(table), ignore_errors=True)
+            manifest = {"headers": list(rows[0]) if rows else [], "partitions": {}}
+            self._append_partitioned(table, rows[1:], manifest["headers"], sync=True, manifest=manifest)
+            self.cache.invalidate(self.path(table))
+            self._indexes.pop(table, None)
+            return manifest
+
+    def _partitions(self, table, first_month=None, last_month=None):
+        """Return the partition tables of a table in month order, optionally for a range of months"""
+        manifest = self._manifest(table)
+        if manifest is None:
+            return []
+        return [self.partition_table(table, month) for month in sorted(manifest["partitions"])
+                if in_period(None if month == UNDATED_PARTITION else month, first_month, last_month)]
+
+    def _append_partitioned(self, table, rows, headers, sync=False, manifest=None):
+        """Append rows to the partitions of the months they are dated in"""
+        with self._lock:
+            if manifest is None:
+                manifest = self._manifest(table) or {"headers": list(headers), "partitions": {}}
+            groups = {}  # month -> rows, in the order they were given
+            for row in rows:
+                groups.setdefault(row_month(table, row) or UNDATED_PARTITION, []).append(row)
+            partitions = manifest["partitions"]
+            new_months = [month for month in groups if month not in partitions]
+            reopened = [month for month in groups if partitions.get(month, {}).get("sealed")]
+            for month in new_months + reopened:
+                partitions[month] = {"sealed": False}
+            # List new partitions before writing them, so no written row is ever unlisted
+            if new_months or reopened or not os.path.isfile(self.manifest_path(table)):
+                self._save_manifest(table, manifest)
+            for month, group in groups.items():
+                self.append_rows(self.partition_table(table, month), group, manifest["headers"], sync)
+            if new_months or reopened:
+                self._seal_partitions(table, manifest)
+
+    def _seal_partitions(self, table, manifest):
+        """
+        Compact and snapshot the partitions of months that are over.
+
+        Sealed partitions are not expected to change again; a later write to
+        one reopens it and seals it again.
+        """
+        current = time.strftime("%Y-%m", time.gmtime())
+        sealed = False
+        for month, info in manifest["partitions"].items():
+            if info.get("sealed") or month == UNDATED_PARTITION or month >= current:
+                continue
+            partition = self.partition_table(table, month)
+            self.compact(partition)
+            self.checkpoint(partition)
+            info["sealed"] = sealed = True
+        if sealed:
+            self._save_manifest(table, manifest)
+
+    def _reopen(self, table, counts):
+        """Seal partitions of past months again after a change reopened them"""
+        manifest = self._manifest(table)
+        reopened = False
+        for partition, count in counts:
+            month = os.path.splitext(os.path.basename(partition))[0]
+            info = manifest["partitions"].get(month)
+            if count and info and info.get("sealed"):
+                info["sealed"] = False
+                reopened = True
+        if reopened:
+            # Saved first, so an interrupted seal leaves them listed as open
+            self._save_manifest(table, manifest)
+            self._seal_partitions(table, manifest)
+
+    def checkpoint(self, table):
+        """Snapshot a table's CSV file as it is now"""
+        with self._lock:
+            if not os.path.isfile(self.path(table)):
+                return
+            rows = self._read_base(table)
+            with open(self.path(table), mode='rb') as file:
+                stat = os.fstat(file.fileno())
+                self._checkpoint(table, rows, stat.st_ino, stat.st_size, file)
+
+    def _read_partitioned(self, table):
+        manifest = self._manifest(table)
+        if manifest is None:
+            return []
+        partitions = self._partitions(table)
+        parts = [self.read_table(partition) for partition in partitions]
+        # Hand out the same rows while no partition changed, like a single cached table
+        merged = self._merged.get(table)
+        if merged is not None and self._same_parts(merged[0], parts):
+            return merged[1]
+        rows = [tuple(manifest["headers"])]
+        for part in parts:
+            rows.extend(part[1:])
+        self._merged[table] = [parts, rows, None, partitions]
+        return rows
+
+    @staticmethod
+    def _same_parts(old, new):
+        return len(old) == len(new) and all(first is second for first, second in zip(old, new))
+
+    def _derived_partitioned(self, table, rows, build):
+        """Derive from each partition separately, so their cache entries keep what belongs to them"""
+        merged = self._merged.get(table)
+        if merged is None or merged[1] is not rows:
+            return build(rows)
+        parts = [self.derived(partition, part, build) for partition, part in zip(merged[3], merged[0])]
+        if merged[2] is not None and self._same_parts(merged[2][0], parts):
+            return merged[2][1]
+        derived = build(rows[:1])
+        for part in parts:
+            derived.extend(part[1:])
+        merged[2] = (parts, derived)
+        return derived
+
+    def _iter_partitioned(self, table, match=None, first_month=None, last_month=None):
+        manifest = self._manifest(table)
+        if manifest is None:
+            return
+        yield tuple(manifest["headers"])
+        for partition in self._partitions(table, first_month, last_month):
+            rows = self.iter_rows(partition, match)
+            next(rows, None)  # Skip the partition's header
+            yield from rows
+
+    def _replace_partitioned(self, table, rows):
+        with self._lock:
+            for partition in self._partitions(table):
+                self.cache.invalidate(self.path(partition))
+                self._indexes.pop(partition, None)
+            shutil.rmtree(self.partition_folder(table), ignore_errors=True)
+            rows = list(rows)
+            manifest = {"headers": list(rows[0]) if rows else [], "partitions": {}}
+            self._append_partitioned(table, rows[1:], manifest["headers"], manifest=manifest)
+
+    def table_exists(self, table):
+        if table in TABLE_PARTITIONS:
+            return os.path.isfile(self.manifest_path(table)) or os.path.isfile(self.path(table))
+        return os.path.isfile(self.path(table))
+
+    def create_table(self, table, headers):
+        with self._lock:
+            if table in TABLE_PARTITIONS and not self.table_exists(table):
+                self._save_manifest(table, {"headers": list(headers), "partitions": {}})
+            elif not self.table_exists(table):
+                self.append_rows(table, [], headers)
+
+    def read_table(self, table):
+        if table in TABLE_PARTITIONS:
+            return self._read_partitioned(table)
+        if not os.path.isfile(self.path(table)):
+            return []
+        return self._load(table)[0]
+
+    def derived(self, table, rows, build):
+        if table in TABLE_PARTITIONS:
+            return self._derived_partitioned(table, rows, build)
+        with self._lock:
+            state = self.cache.get(self.path(table), self._signature(table))
+        if state is None or state[0] is not rows:
+            return build(rows)
+        return self.cache.derive(self.path(table), state, lambda: build(rows))
+
+    def append_rows(self, table, rows, headers, sync=False):
+        if table in TABLE_PARTITIONS:
+            return self._append_partitioned(table, rows, headers, sync)
+        file_path = self.path(table)
+        with self._lock:
+            with open(file_path, mode='ab') as file:
+                start = file.tell()
+                # Stored as text, so keep the index in step with what is written
+                rows = [tuple("" if value is None else str(value) for value in row) for row in rows]
+                if start == 0:  # New or empty file, write header
+                    rows.insert(0, tuple(headers))
+                encoded = encode_rows(rows)
+                file.write(b"".join(encoded))
+                if sync:
+                    file.flush()
+                    os.fsync(file.fileno())
+            self.cache.invalidate(file_path)
+            if self._index(table):
+                self._index(table).extend(start, list(zip(rows, encoded)))
+
+    def replace_table(self, table, rows):
+        if table in TABLE_PARTITIONS:
+            return self._replace_partitioned(table, rows)
+        file_path = self.path(table)
+        with self._lock:
+            with open(file_path, mode='w', newline='', encoding=ENCODING) as file:
+                writer = csv.writer(file)
+                writer.writerows(rows)
+            remove_snapshot(self.snapshot_path(table))  # It describes the old contents
+            if os.path.isfile(self.log_path(table)):
+                os.remove(self.log_path(table))
+            self.cache.invalidate(file_path)
+            if self._index(table):
+                self._index(table).invalidate()
+
+    def iter_rows(self, table, match=None):
+        if table in TABLE_PARTITIONS:
+            yield from self._iter_partitioned(table, match)
+            return
+        file_path = self.path(table)
+        # Everything read under the lock describes one version of the table; the
+        # lock is released before the first row is yielded
+        with self._lock:
+            if not os.path.isfile(file_path):
+                return
+            rows = self._lookup(table, [match]) if match else None
+            if rows is not None:
+                with open(file_path, mode='rb') as file:
+                    header = next(iter_records(file), None)
+            else:
+                state = self.cache.get(file_path, self._signature(table))
+                if state is None:
+                    # Not cached: parse and merge the log one row at a time. The
+                    # open file keeps its contents if a compaction replaces it.
+                    entries = self._parsed_log(table)
+                    file = open(file_path, mode='r', newline='', encoding=ENCODING)
+        if rows is not None:
+            yield header[0] if header else ()
+            yield from rows
+            return
+        if state is not None:
+            rows = state[0]
+            if rows:
+                yield rows[0]
+            for row in rows[1:]:
+                if match is None or row_matches(row, match):
+                    yield row
+            return
+
+        with file:
+            for position, row in enumerate(csv.reader(file)):
+                row = tuple(row)
+                if position == 0:
+                    yield row
+                    continue
+                row = self._replay_row(row, position, entries)
+                if row is not None and (match is None or row_matches(row, match)):
+                    yield row
+
+    def iter_period(self, table, first_month=None, last_month=None, match=None):
+        if table not in TABLE_PARTITIONS:
+            raise ValueError(f"{table} is not partitioned by date")
+        # Only the partitions of the requested months are opened
+        return self._iter_partitioned(table, match, first_month, last_month)
+
+    def find_rows(self, table, match, limit=None):
+        if table in TABLE_PARTITIONS:
+            found = []
+            for partition in self._partitions(table):
+                found += self.find_rows(partition, match, None if limit is None else limit - len(found))
+                if limit is not None and len(found) >= limit:
+                    break
+            return found
+        rows = self._lookup(table, [match], limit) if match else None
+        if rows is not None:
+            return rows
+        found = []
+        for row in self.read_table(table)[1:]:
+            if row_matches(row, match):
+                found.append(row)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def find_rows_any(self, table, matches):
+        if table in TABLE_PARTITIONS:
+            return [row for partition in self._partitions(table)
+                    for row in self.find_rows_any(partition, matches)]
+        rows = self._lookup(table, matches) if matches else None
+        if rows is not None:
+            return rows
+        return StorageBackend.find_rows_any(self, table, matches)
+
+    def update_rows(self, table, match, changes):
+        if not changes:
+            return 0
+        changes = {column: "" if value is None else str(value) for column, value in changes.items()}
+        with self._lock:
+            if table in TABLE_PARTITIONS:
+                counts = [(partition, self.update_rows(partition, match, changes))
+                          for partition in self._partitions(table)]
+                self._reopen(table, counts)
+                return sum(count for _, count in counts)
+            if not self.table_exists(table):
+                return 0
+            return self._log(table, {"op": "update", "match": match, "set": changes})
+
+    def update_many(self, table, updates):
+        updates = [(match, {column: "" if value is None else str(value) for column, value in changes.items()})
+                   for match, changes in updates if changes]
+        if not updates:
+            return 0
+        with self._lock:
+            if table in TABLE_PARTITIONS:
+                counts = [(partition, self.update_many(partition, updates))
+                          for partition in self._partitions(table)]
+                self._reopen(table, counts)
+                return sum(count for _, count in counts)
+            if not self.table_exists(table):
+                return 0
+            return self._log_many(table, [{"op": "update", "match": match, "set": changes}
+                                          for match, changes in updates])
+
+    def delete_rows(self, table, match):
+        with self._lock:
+            if table in TABLE_PARTITIONS:
+                counts = [(partition, self.delete_rows(partition, match))
+                          for partition in self._partitions(table)]
+                self._reopen(table, counts)
+                return sum(count for _, count in counts)
+            if not self.table_exists(table):
+                return 0
+            return self._log(table, {"op": "delete", "match": match})
+
+class SQLiteBackend(StorageBackend):
+    """
+    Stores tables in an embedded SQLite database.
+
+    Each table gets one TEXT column per CSV column, an INTEGER PRIMARY KEY that
+    keeps insertion order, and indexes on its ID column (TABLE_KEYS) and on
+    the columns listed in TABLE_INDEXES.
+    Tables missing from the database are imported from the matching CSV file
+    in DATA_FOLDER the first time they are used.
+    """
+
+    def __init__(self, db_file=SQLITE_FILE, data_folder=DATA_FOLDER):
+        self.db_file = db_file
+        self.data_folder = data_folder
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS _farmgate_tables "
+            "(name TEXT PRIMARY KEY, sql_name TEXT, headers TEXT, columns TEXT)"
+        )
+        self._conn.commit()
+        self._tables = {}  # table -> (sql name, column names)
+        for name, sql_name, headers, columns in self._conn.execute(
+                "SELECT name, sql_name, headers, columns FROM _farmgate_tables"):
+            self._tables[name] = (sql_name, json.loads(columns))
+            self._create_indexes(name)  # Databases created before an index was declared
+        self._conn.commit()
+
+    @staticmethod
+    def _identifier(name):
+        name = re.sub(r"\W+", "_", name.strip().lower()).strip("_")
+        return name or "col"
+
+    def _define(self, table, headers):
+        """Create the SQL table for a FarmGate table and record its layout"""
+        sql_name = self._identifier(os.path.splitext(table)[0])
+        columns = []
+        for position, header in enumerate(headers):
+            column = self._identifier(str(header))
+            if column in columns or column.startswith("_"):
+                column = f"col_{position}"
+            columns.append(column)
+        column_sql = "".join(f', "{column}" TEXT' for column in columns)
+        self._conn.execute(f'CREATE TABLE "{sql_name}" (_rowid INTEGER PRIMARY KEY{column_sql})')
+        self._conn.execute(
+            "INSERT INTO _farmgate_tables (name, sql_name, headers, columns) VALUES (?, ?, ?, ?)",
+            (table, sql_name, json.dumps(list(headers)), json.dumps(columns))
+        )
+        self._tables[table] = (sql_name, columns)
+        self._create_indexes(table)
+
+    def _create_indexes(self, table):
+        """Index the ID column and the TABLE_INDEXES columns that the table has"""
+        sql_name, columns = self._tables[table]
+        for position in indexed_columns(table):
+            if position < len(columns):
+                column = columns[position]
+                self._conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{sql_name}_{column}_idx" ON "{sql_name}" ("{column}")'
+                )
+
+    def _widen(self, table, width):
+        """Add columns so rows wider than the header can be stored"""
+        sql_name, columns = self._tables[table]
+        while len(columns) < width:
+            column = f"col_{len(columns)}"
+            self._conn.execute(f'ALTER TABLE "{sql_name}" ADD COLUMN "{column}" TEXT')
+            columns.append(column)
+        self._conn.execute(
+            "UPDATE _farmgate_tables SET columns = ? WHERE name = ?", (json.dumps(columns), table)
+        )
+        self._create_indexes(table)
+
+    def _ensure(self, table):
+        """Make sure a table is defined, importing its CSV file if needed"""
+        if table in self._tables:
+            return True
+        # Read through the CSV engine, so its update log and monthly
+        # partitions are applied as they would be there
+        source = CSVBackend(self.data_folder, TableCache())
+        if not source.table_exists(table):
+            return False
+        rows = source.read_table(table)
+        self._define(table, rows[0] if rows else [])
+        self._insert(table, rows[1:])
+        self._conn.commit()
+        return True
+
+    def _insert(self, table, rows):
+        rows = [["" if value is None else str(value) for value in row] for row in rows]
+        if not rows:
+            return
+        width = max(len(row) for row in rows)
+        if width > len(self._tables[table][1]):
+            self._widen(table, width)
+        sql_name, columns = self._tables[table]
+        # One executemany per run of equally wide rows keeps the insertion order
+        for width, group in groupby(rows, key=len):
+            group = list(group)
+            if not width:
+                for _ in group:
+                    self._conn.execute(f'INSERT INTO "{sql_name}" DEFAULT VALUES')
+                continue
+            names = ", ".join(f'"{column}"' for column in columns[:width])
+            placeholders = ", ".join("?" for _ in range(width))
+            self._conn.executemany(f'INSERT INTO "{sql_name}" ({names}) VALUES ({placeholders})', group)
+
+    @staticmethod
+    def _to_row(values):
+        values = list(values)
+        while values and values[-1] is None:
+            values.pop()  # Short rows are stored with trailing NULLs
+        return tuple("" if value is None else value for value in values)
+
+    def _condition(self, table, match):
+        """Return the SQL condition and parameters for a filter (None if it can never match)"""
+        columns = self._tables[table][1]
+        if any(column >= len(columns) for column in match):
+            return None, None
+        clause = " AND ".join(f'"{columns[column]}" = ?' for column in match)
+        return clause, [str(value) for value in match.values()]
+
+    def _where(self, table, match):
+        clause, params = self._condition(table, match)
+        if clause is None:
+            return None, None
+        return (f" WHERE {clause}" if clause else ""), params
+
+    def table_exists(self, table):
+        with self._lock:
+            return self._ensure(table)
+
+    def create_table(self, table, headers):
+        with self._lock:
+            if not self._ensure(table):
+                self._define(table, headers)
+                self._conn.commit()
+
+    def read_table(self, table):
+        with self._lock:
+            if not self._ensure(table):
+                return []
+            sql_name, columns = self._tables[table]
+            headers = self._conn.execute(
+                "SELECT headers FROM _farmgate_tables WHERE name = ?", (table,)
+            ).fetchone()[0]
+            column_sql = ", ".join(f'"{column}"' for column in columns) or "NULL"
+            cursor = self._conn.execute(f'SELECT {column_sql} FROM "{sql_name}" ORDER BY _rowid')
+            return [tuple(json.loads(headers))] + [self._to_row(values) for values in cursor]
+
+    def append_rows(self, table, rows, headers, sync=False):
+        # Every commit is synced by SQLite, so sync needs no extra work here
+        with self._lock:
+            if not self._ensure(table):
+                self._define(table, headers)
+            self._insert(table, rows)
+            self._conn.commit()
+
+    def replace_table(self, table, rows):
+        with self._lock:
+            if self._ensure(table):
+                sql_name = self._tables[table][0]
+                self._conn.execute(f'DROP TABLE "{sql_name}"')
+                self._conn.execute("DELETE FROM _farmgate_tables WHERE name = ?", (table,))
+                del self._tables[table]
+            rows = list(rows)
+            self._define(table, rows[0] if rows else [])
+            self._insert(table, rows[1:])
+            self._conn.commit()
+
+    def iter_rows(self, table, match=None):
+        with self._lock:
+            if not self._ensure(table):
+                return
+            sql_name, columns = self._tables[table]
+            headers = self._conn.execute(
+                "SELECT headers FROM _farmgate_tables WHERE name = ?", (table,)
+            ).fetchone()[0]
+            where, params = self._where(table, match or {})
+            if where is None:
+                return
+            column_sql = ", ".join(f'"{column}"' for column in columns) or "NULL"
+            cursor = self._conn.execute(
+                f'SELECT {column_sql} FROM "{sql_name}"{where} ORDER BY _rowid', params
+            )
+        yield tuple(json.loads(headers))
+        while True:
+            # Fetch in chunks so the connection is not held while the caller works
+            with self._lock:
+                chunk = cursor.fetchmany(ITER_CHUNK_ROWS)
+            if not chunk:
+                break
+            for values in chunk:
+                yield self._to_row(values)
+
+    def find_rows(self, table, match, limit=None):
+        with self._lock:
+            if not self._ensure(table):
+                return []
+            where, params = self._where(table, match)
+            if where is None:
+                return []
+            sql_name, columns = self._tables[table]
+            column_sql = ", ".join(f'"{column}"' for column in columns) or "NULL"
+            sql = f'SELECT {column_sql} FROM "{sql_name}"{where} ORDER BY _rowid'
+            if limit is not None:
+                sql += f" LIMIT {int(limit)}"
+            return [self._to_row(values) for values in self._conn.execute(sql, params)]
+
+    def find_rows_any(self, table, matches):
+        with self._lock:
+            if not self._ensure(table):
+                return []
+            clauses, params = [], []
+            for match in matches:
+                clause, values = self._condition(table, match)
+                if clause is None:
+                    continue  # Filters on columns the table lacks match nothing
+                clauses.append(f"({clause})" if clause else "1")
+                params += values
+            if not clauses:
+                return []
+            sql_name, columns = self._tables[table]
+            column_sql = ", ".join(f'"{column}"' for column in columns) or "NULL"
+            # SQLite limits the depth of an expression, so long lists of
+            # filters are queried in chunks and merged back into table order
+            found = {}
+            start = 0
+            for first in range(0, len(clauses), SQLITE_MAX_OR_CLAUSES):
+                chunk = clauses[first:first + SQLITE_MAX_OR_CLAUSES]
+                count = sum(clause.count("?") for clause in chunk)
+                sql = f'SELECT _rowid, {column_sql} FROM "{sql_name}" WHERE {" OR ".join(chunk)}'
+                for values in self._conn.execute(sql, params[start:start + count]):
+                    found[values[0]] = values[1:]
+                start += count
+            return [self._to_row(found[rowid]) for rowid in sorted(found)]
+
+    def update_rows(self, table, match, changes):
+        with self._lock:
+            count = self._update(table, match, changes)
+            self._conn.commit()
+            return count
+
+    def update_many(self, table, updates):
+        # One transaction, so the batch costs a single commit
+        with self._lock:
+            count = sum(self._update(table, match, changes) for match, changes in updates)
+            self._conn.commit()
+            return count
+
+    def _update(self, table, match, changes):
+        """Run one UPDATE without committing; return the count"""
+        with self._lock:
+            if not self._ensure(table) or not changes:
+                return 0
+            where, params = self._where(table, match)
+            if where is None:
+                return 0
+            if max(changes) >= len(self._tables[table][1]):
+                self._widen(table, max(changes) + 1)
+            sql_name, columns = self._tables[table]
+            # Columns skipped over by the update become "" rather than NULL
+            width = max(changes) + 1
+            assignments = [f'"{columns[column]}" = COALESCE("{columns[column]}", \'\')'
+                           for column in range(width) if column not in changes]
+            assignments += [f'"{columns[column]}" = ?' for column in changes]
+            values = ["" if value is None else str(value) for value in changes.values()]
+            cursor = self._conn.execute(
+                f'UPDATE "{sql_name}" SET {", ".join(assignments)}{where}', values + params
+            )
+            return cursor.rowcount
+
+    def delete_rows(self, table, match):
+        with self._lock:
+            if not self._ensure(table):
+                return 0
+            where, params = self._where(table, match)
+            if where is None:
+                return 0
+            cursor = self._conn.execute(f'DELETE FROM "{self._tables[table][0]}"{where}', params)
+            self._conn.commit()
+            return cursor.rowcount
+
+def create_backend(engine=STORAGE_ENGINE):
+    """Build the storage backend named by engine ("csv" or "sqlite")"""
+    if engine == "csv":
+        return CSVBackend()
+    if engine == "sqlite":
+        return SQLiteBackend()
+    raise ValueError(f"Unknown storage engine: {engine}")
@@ -0,0 +1,11 @@
+import pytest
+import database
+from database import Database
+from storage import CSVBackend, TableCache
+
+@pytest.fixture
+def data_folder(tmp_path, monkeypatch):
+    """Point Database, and everything that keeps files next to the tables, at an empty folder"""
+    monkeypatch.setattr(database, "DATA_FOLDER", str(tmp_path))
+    monkeypatch.setattr(Database, "backend", CSVBackend(str(tmp_path), TableCache()))
+    return tmp_path
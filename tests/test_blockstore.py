@@ -0,0 +1,106 @@
+import marshal
+import multiprocessing
+import threading
+import time
+import zlib
+import pytest
+import blockstore
+from blockstore import BlockStore, SEGMENT_MAGIC
+
+def record(position, transactions=None):
+    return (position, 1700000000.0 + position, f"prev{position}", f"hash{position}", position, 3,
+            f"root{position}", transactions if transactions is not None else [{"id": f"T{position}"}])
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(blockstore, "SEGMENT_BLOCKS", 4)
+    store = BlockStore(str(tmp_path / "blocks"))
+    store.append([record(position) for position in range(6)])
+    return store
+
+def transactions(store):
+    headers = store.headers()
+    return [body[0]["id"] if body else None for body in store.bodies(headers)]
+
+def test_records_span_segments(store):
+    assert store._segments() == [0, 1]
+    assert store.append([record(6)]) == 6
+    reopened = BlockStore(store.folder)
+    assert len(reopened) == 7
+    assert [entry[3] for _, entry in reopened.headers(3)] == ["hash3", "hash4", "hash5", "hash6"]
+    assert transactions(reopened) == [f"T{position}" for position in range(7)]
+    position, entry = reopened.headers(5)[0]
+    assert reopened.read_transactions(position, entry[7], entry[8]) == [{"id": "T5"}]
+
+def test_torn_record_is_cut_off(store):
+    with open(store._segment_path(1), mode='ab') as file:
+        file.write(b"\x40\x00\x00\x00partial")  # Length prefix of a record that never finished
+    reopened = BlockStore(store.folder)
+    assert len(reopened) == 6
+    assert reopened.append([record(6)]) == 6
+    assert transactions(BlockStore(store.folder))[-2:] == ["T5", "T6"]
+
+def test_unindexed_record_is_indexed_again(store):
+    data = zlib.compress(b'[6, 1.0, "prev6", "hash6", 6, 3, "root6", [{"id": "T6"}]]')
+    store._write_chunks(store._segment_path(1), SEGMENT_MAGIC, [data])  # Index entry never written
+    reopened = BlockStore(store.folder)
+    assert [entry[3] for _, entry in reopened.headers(6)] == ["hash6"]
+
+def test_index_entries_past_the_records_are_dropped(store):
+    position, entry = store.headers(5)[0]
+    with open(store._segment_path(1), mode='r+b') as file:
+        file.truncate(entry[7] + 2)  # Record 5 lost, its index entry kept
+    reopened = BlockStore(store.folder)
+    assert len(reopened) == 5 and transactions(reopened)[-1] == "T4"
+    assert len(BlockStore(store.folder)) == 5  # Stays consistent once repaired
+
+def test_an_emptied_segment_reopens(store):
+    with open(store._segment_path(1), mode='r+b') as file:
+        file.truncate(3)  # Not even the segment header survived
+    assert len(BlockStore(store.folder)) == 4
+    reopened = BlockStore(store.folder)
+    assert reopened.append([record(4)]) == 4
+    assert transactions(BlockStore(store.folder)) == ["T0", "T1", "T2", "T3", "T4"]
+
+def test_a_torn_tail_is_repaired_before_appending(store):
+    with open(store._segment_path(1), mode='ab') as file:
+        file.write(b"\x40\x00")  # Left by a writer that died after the store was opened
+    assert store.append([record(6)]) == 6
+    assert transactions(BlockStore(store.folder)) == [f"T{position}" for position in range(7)]
+
+def test_opening_waits_for_a_writer(store):
+    # Halfway through an append by another process: the record is on disk, its index entry is not
+    store._store_lock.__enter__()
+    data = zlib.compress(b'[6, 1.0, "prev6", "hash6", 6, 3, "root6", [{"id": "T6"}]]')
+    offset = store._write_chunks(store._segment_path(1), SEGMENT_MAGIC, [data])[0]
+    opened = []
+    thread = threading.Thread(target=lambda: opened.append(BlockStore(store.folder)))
+    thread.start()
+    time.sleep(0.2)
+    assert not opened  # Recovery waits rather than indexing the record itself
+    entry = (6, 1.0, "prev6", "hash6", 6, 3, "root6", offset, len(data))
+    store._write_chunks(store._index_path(1), blockstore.INDEX_MAGIC, [marshal.dumps(entry)])
+    store._store_lock.__exit__(None, None, None)
+    thread.join(10)
+    assert [entry[3] for _, entry in opened[0].headers(5)] == ["hash5", "hash6"]
+
+def append_from_process(folder, worker, count):
+    blockstore.SEGMENT_BLOCKS = 4
+    store = BlockStore(folder)
+    for number in range(count):
+        store.append([record(1000 * worker + number)])
+
+def test_processes_append_without_overwriting_each_other(store):
+    processes = [multiprocessing.Process(target=append_from_process, args=(store.folder, worker, 15))
+                 for worker in range(1, 5)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    reopened = BlockStore(store.folder)
+    assert len(reopened) == 66
+    ids = transactions(reopened)
+    assert ids[:6] == [f"T{position}" for position in range(6)]
+    assert sorted(ids[6:]) == sorted(f"T{1000 * worker + number}" for worker in range(1, 5) for number in range(15))
+    assert [entry[3] for _, entry in reopened.headers()] == [f"hash{id[1:]}" for id in ids]
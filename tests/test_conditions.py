@@ -0,0 +1,71 @@
+import time
+import pytest
+from blockchain import CONTRACT_HEADERS, TRANSACTION_HEADERS, SmartContract
+from conditions import ContractState, check_conditions, compile_terms, evaluate_contracts
+from database import Database
+
+NOW = 1700000000.0
+
+def contract(contract_id, buyer_id="B1", product_id="P1", price=100.0, conditions=None, age=0):
+    terms = "Standard purchase agreement."
+    if conditions is not None:
+        terms += " Conditions: " + conditions
+    contract = SmartContract(contract_id, buyer_id, "S1", product_id, price, terms)
+    contract.creation_time = NOW - age
+    return contract
+
+@pytest.fixture
+def market(data_folder):
+    for product_id, price in (("P1", "100.0"), ("P2", "50.0")):
+        Database.write_to_csv("marketplace.csv", [product_id, "F1", "Rice", price],
+                              ["Product ID", "Farmer ID", "Product Name", "Price"])
+    Database.write_to_csv("blockchain_transactions.csv",
+                          ["T1", "B1", "S1", "P1", "100.0", str(time.time()), "Confirmed", "h"], TRANSACTION_HEADERS)
+    Database.write_to_csv("blockchain_transactions.csv",
+                          ["T2", "B1", "S1", "P2", "50.0", str(time.time()), "Pending", ""], TRANSACTION_HEADERS)
+    Database.write_to_csv("smart_contracts.csv",
+                          ["C0", "B1", "S1", "P1", "300.0", "", "Executed", str(NOW), str(NOW)], CONTRACT_HEADERS)
+
+def check(item):
+    return check_conditions(item, ContractState([item], now=NOW))
+
+def test_terms_compile_once_per_template():
+    terms = "Deal. Conditions: delivery confirmed; Payment  within 72h; price within 5%; buyer limit 5000."
+    conditions = compile_terms(terms)
+    assert [text for text, _ in conditions] == [
+        "delivery confirmed", "Payment within 72h", "price within 5%", "buyer limit 5000"]
+    assert compile_terms(terms) is conditions
+    assert compile_terms("No conditions here") == ()
+    assert check_conditions(contract("C1")) == (True, "Contract conditions met")
+
+def test_each_rule(market):
+    assert check(contract("C1", conditions="delivery confirmed"))[0]
+    assert not check(contract("C1", product_id="P2", conditions="delivery confirmed"))[0]
+    assert check(contract("C1", conditions="payment within 2d", age=3600))[0]
+    assert check(contract("C1", conditions="payment within 30m", age=3600)) == (
+        False, "Contract conditions not met: payment within 30m")
+    assert check(contract("C1", price=104.0, conditions="price within 5%"))[0]
+    assert not check(contract("C1", price=106.0, conditions="price within 5%"))[0]
+    assert not check(contract("C1", product_id="P9", conditions="price within 5%"))[0]  # Not listed
+    assert check(contract("C1", price=200.0, conditions="buyer limit 500"))[0]  # 300 spent already
+    assert not check(contract("C1", price=201.0, conditions="buyer limit 500"))[0]
+    assert check(contract("C1", conditions="delivery confirmed; moon is full")) == (
+        False, "Contract conditions not met: unknown condition 'moon is full'")
+
+def test_batches_share_state_and_buyer_limits(market, monkeypatch):
+    reads = []
+    find_rows_any = Database.find_rows_any
+
+    def counting(filename, matches):
+        reads.append(filename)
+        return find_rows_any(filename, matches)
+    monkeypatch.setattr(Database, "find_rows_any", staticmethod(counting))
+    batch = [contract(f"C{number}", price=60.0, product_id="P1",
+                      conditions="delivery confirmed; price within 50%; buyer limit 500")
+             for number in range(1, 6)]
+    batch.append(contract("C9", buyer_id="B2", conditions="delivery confirmed"))
+    results = evaluate_contracts(batch)
+    # 300 executed before the batch leaves room for three contracts of 60
+    assert [results[f"C{number}"][0] for number in range(1, 6)] == [True, True, True, False, False]
+    assert results["C9"] == (False, "Contract conditions not met: delivery confirmed")
+    assert sorted(reads) == ["blockchain_transactions.csv", "marketplace.csv", "smart_contracts.csv"]
@@ -0,0 +1,108 @@
+import json
+import multiprocessing
+import os
+import pytest
+import mempool as mempool_module
+import blockchain as blockchain_module
+from blockchain import MEMPOOL_FILE, Blockchain, BlockMiner, get_blockchain
+from mempool import Mempool
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "mempool.log")
+
+def leave_behind(path, *transactions):
+    """Write "add" records as a run that stopped before mining them would have"""
+    with open(path, mode='a') as file:
+        for number, transaction in enumerate(transactions):
+            file.write(json.dumps({"op": "add", "id": f"E{number}", "tx": transaction,
+                                   "miner": "farmer", "time": 0}) + "\n")
+
+def test_entries_survive_a_restart(path):
+    mempool = Mempool(path)
+    first = mempool.add({"id": "T1"}, "admin")
+    batch = mempool.add_many([{"id": "T2"}, {"id": "T3"}], grouped=True)
+    mempool.mark_mined([first], "hash1")
+    with open(path, mode='a') as file:
+        file.write('{"op": "add", "id": "torn"')  # Cut off mid-write
+    mempool.close()
+    reopened = Mempool(path)
+    assert [entry.transaction["id"] for entry in reopened.pending()] == ["T2", "T3"]
+    assert {entry.group for entry in reopened.pending()} == {batch[0].group}
+    assert reopened.status(batch[0].entry_id) == "pending"
+    assert reopened.status(first.entry_id) == "unknown"
+    assert first.future.result(0) == "hash1"
+
+def test_entries_of_a_running_mempool_are_left_to_it(path):
+    first = Mempool(path)
+    first.add({"id": "T1"})
+    assert len(Mempool(path)) == 0  # Still running, so T1 is first's to mine
+    first.close()
+    taken = Mempool(path)
+    assert [entry.transaction["id"] for entry in taken.pending()] == ["T1"]
+    assert len(Mempool(path)) == 0  # Taken over, and taken is still running
+
+def add_from_process(path):
+    Mempool(path).add({"id": "T9"})  # The process exits without closing it
+
+def test_entries_of_a_stopped_process_are_taken_over(path):
+    process = multiprocessing.Process(target=add_from_process, args=(path,))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+    mempool = Mempool(path)
+    assert [entry.transaction["id"] for entry in mempool.pending()] == ["T9"]
+    locks = sorted(name for name in os.listdir(os.path.dirname(path)) if name.endswith(".lock"))
+    assert locks == sorted([f"mempool.log.{mempool.owner}.lock", "mempool.log.lock"])  # The stopped one's is gone
+
+def test_compaction_keeps_entries_of_other_processes(path, monkeypatch):
+    monkeypatch.setattr(mempool_module, "MEMPOOL_COMPACT_BYTES", 0)
+    other, mine = Mempool(path), Mempool(path)
+    other.add({"id": "T1"})
+    entry = mine.add({"id": "T2"})
+    mine.mark_mined([entry], "hash2")  # Drains mine, so the log is rewritten
+    with open(path) as file:
+        assert [json.loads(line)["tx"]["id"] for line in file] == ["T1"]
+    other.close()
+    assert [entry.transaction["id"] for entry in Mempool(path).pending()] == ["T1"]
+
+def test_leftover_entries_are_mined_when_the_chain_loads(data_folder, monkeypatch):
+    monkeypatch.setattr(blockchain_module, "_blockchain", None)
+    monkeypatch.setattr(blockchain_module, "_miner", None)
+    monkeypatch.setattr(blockchain_module, "_mempool", None)
+    leave_behind(str(data_folder / MEMPOOL_FILE), {"id": "T1", "amount": 5})
+    blockchain = get_blockchain()  # Nothing new is queued
+    miner = blockchain_module._miner
+    assert miner is not None
+    assert miner.mempool.wait(lambda: not len(miner.mempool), timeout=30)
+    assert blockchain.locate_transaction("T1")["block_index"] == 1
+    assert len(Mempool(str(data_folder / MEMPOOL_FILE))) == 0
+
+def test_no_miner_starts_for_an_empty_mempool(data_folder, monkeypatch):
+    monkeypatch.setattr(blockchain_module, "_blockchain", None)
+    monkeypatch.setattr(blockchain_module, "_miner", None)
+    monkeypatch.setattr(blockchain_module, "_mempool", None)
+    get_blockchain()
+    assert blockchain_module._miner is None
+
+def test_entries_already_in_a_block_are_not_mined_again(data_folder):
+    blockchain = Blockchain()
+    block = blockchain.seal_transactions([{"id": "T1"}], "admin")
+    path = str(data_folder / MEMPOOL_FILE)
+    leave_behind(path, {"id": "T1"})  # Stopped after storing the block, before marking it mined
+    mempool = Mempool(path)
+    entry = mempool.pending()[0]
+    BlockMiner(blockchain, mempool).start()
+    assert entry.future.result(0) == block.hash
+    assert len(blockchain.chain) == 2 and len(Mempool(path)) == 0
+
+def test_mining_on_demand_pays_the_given_address(data_folder, monkeypatch):
+    blockchain = Blockchain()
+    miner = BlockMiner(blockchain, Mempool(str(data_folder / MEMPOOL_FILE)), max_delay=60)
+    monkeypatch.setattr(blockchain_module, "_miner", miner)
+    miner.start()
+    miner.submit({"id": "T1"}, "farmer")
+    assert blockchain.mine_pending_transactions("admin2")
+    reward = blockchain.get_latest_block().transactions[-1]
+    assert (reward["type"], reward["recipient"]) == ("reward", "admin2")
+    assert not blockchain.mine_pending_transactions("admin2")  # Nothing left
@@ -0,0 +1,41 @@
+import copy
+import pytest
+from blockchain import Blockchain
+from merkle import EMPTY_ROOT, merkle_proof, merkle_root, verify_proof
+
+def transactions(count):
+    return [{"id": f"T{number}", "amount": number} for number in range(count)]
+
+@pytest.mark.parametrize("count", range(1, 10))
+def test_every_transaction_has_a_proof(count):
+    block = transactions(count)
+    root = merkle_root(block)
+    for position, transaction in enumerate(block):
+        assert verify_proof(transaction, merkle_proof(block, position), root)
+
+def test_tampering_is_rejected():
+    block = transactions(7)
+    root = merkle_root(block)
+    proof = merkle_proof(block, 4)
+    assert not verify_proof(dict(block[4], amount=400), proof, root)
+    assert not verify_proof(block[5], proof, root)  # Another transaction with this proof
+    assert not verify_proof(block[4], merkle_proof(block, 4)[1:], root)
+    assert not verify_proof(block[4], [["up", proof[0][1]]] + proof[1:], root)
+    assert merkle_root(block[:6] + [dict(block[6], id="T9")]) != root
+    assert merkle_root([]) == EMPTY_ROOT
+
+def test_ledger_proofs_verify_from_the_header(data_folder):
+    blockchain = Blockchain()
+    blockchain.seal_transactions(transactions(5), "admin")
+    proof = blockchain.get_transaction_proof("T3")
+    assert proof["transaction"] == {"id": "T3", "amount": 3}
+    assert proof["header"]["hash"] == blockchain.chain[1].hash
+    assert Blockchain.verify_transaction_proof(proof)
+
+    forged = copy.deepcopy(proof)
+    forged["transaction"]["amount"] = 300
+    assert not Blockchain.verify_transaction_proof(forged)
+    forged = copy.deepcopy(proof)
+    forged["header"]["merkle_root"] = merkle_root([forged["transaction"]])
+    assert not Blockchain.verify_transaction_proof(forged)  # The header no longer hashes to the block hash
+    assert blockchain.get_transaction_proof("missing") is None
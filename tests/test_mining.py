@@ -0,0 +1,56 @@
+import multiprocessing
+import pytest
+import blockchain as blockchain_module
+import database
+from blockchain import LEGACY_BLOCK_VERSION, Block, Blockchain, find_invalid_block
+from database import Database
+from storage import CSVBackend, TableCache
+
+def block(version=blockchain_module.BLOCK_VERSION):
+    return Block(4, 1700000000.0, [{"id": "T1", "amount": 10}], "ab" * 32, version=version)
+
+@pytest.mark.parametrize("difficulty", [2, 4])
+def test_workers_find_the_serial_nonce(difficulty, monkeypatch):
+    # Small chunks, so the answer lies several chunks in
+    monkeypatch.setattr(blockchain_module, "MINING_CHUNK_NONCES", 500)
+    serial, parallel = block(), block()
+    serial.mine_block(difficulty)
+    parallel.mine_parallel(difficulty, workers=3)
+    assert serial.hash.startswith("0" * difficulty)
+    assert (parallel.nonce, parallel.hash) == (serial.nonce, serial.hash)
+    assert parallel.calculate_hash() == parallel.hash
+
+def test_mining_resumes_after_the_current_nonce():
+    first = block()
+    first.mine_block(3)
+    again = block()
+    again.nonce = first.nonce
+    again.hash = "f" * 64  # Not mined yet
+    again.mine_parallel(3, workers=2)
+    assert again.nonce > first.nonce and again.hash.startswith("000")
+
+def test_legacy_blocks_mine_serially():
+    legacy = block(LEGACY_BLOCK_VERSION)
+    legacy.mine_block(2, workers=4)
+    assert legacy.hash.startswith("00") and legacy.calculate_hash() == legacy.hash
+
+def seal_from_process(folder, worker, count):
+    database.DATA_FOLDER = folder
+    Database.use_backend(CSVBackend(folder, TableCache()))
+    blockchain = Blockchain()
+    blockchain.mining_workers = 1
+    for number in range(count):
+        blockchain.seal_transactions([{"id": f"T{worker}-{number}", "amount": number}], f"miner{worker}")
+
+def test_processes_extend_one_chain(data_folder):
+    processes = [multiprocessing.Process(target=seal_from_process, args=(str(data_folder), worker, 15))
+                 for worker in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+        assert process.exitcode == 0
+    chain = Blockchain().chain
+    assert len(chain) == 46  # Genesis and 45 sealed blocks
+    assert [block.index for block in chain] == list(range(46))
+    assert find_invalid_block(chain) is None
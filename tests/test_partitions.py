@@ -0,0 +1,89 @@
+import json
+import multiprocessing
+import os
+import time
+import pytest
+from storage import CSVBackend, TableCache, partition_month
+
+HEADERS = ("Repayment ID", "Loan ID", "Amount", "Date")
+TABLE = "loan_repayments.csv"
+
+def repayment(number, date):
+    return (f"R{number}", f"L{number % 2}", "10.0", date)
+
+@pytest.fixture
+def backend(tmp_path):
+    return CSVBackend(str(tmp_path), TableCache(), compact_bytes=10 ** 9)
+
+def reopen(backend):
+    return CSVBackend(backend.data_folder, TableCache(), compact_bytes=backend.compact_bytes)
+
+def manifest(backend):
+    with open(backend.manifest_path(TABLE)) as file:
+        return json.load(file)
+
+def test_rows_are_split_by_month(backend):
+    backend.append_rows(TABLE, [repayment(1, "2024-02-10"), repayment(2, "2024-01-05"),
+                                repayment(3, "soon"), repayment(4, "2024-02-11")], HEADERS)
+    assert sorted(manifest(backend)["partitions"]) == ["2024-01", "2024-02", "undated"]
+    assert os.path.isfile(os.path.join(backend.partition_folder(TABLE), "2024-02.csv"))
+    assert not os.path.isfile(backend.path(TABLE))
+    for reader in (backend, reopen(backend)):
+        assert [row[0] for row in reader.read_table(TABLE)[1:]] == ["R2", "R1", "R4", "R3"]
+        assert [row[0] for row in reader.iter_period(TABLE, "2024-02", "2024-12")][1:] == ["R1", "R4"]
+        assert [row[0] for row in reader.find_rows(TABLE, {1: "L0"})] == ["R2", "R4"]
+
+def test_single_file_is_migrated_in_place(backend):
+    with open(backend.path(TABLE), mode='w', newline='') as file:
+        file.write("Repayment ID,Loan ID,Amount,Date\r\nR1,L1,10.0,2024-01-05\r\nR2,L0,10.0,2024-03-01\r\n")
+    backend.update_rows(TABLE, {0: "R2"}, {2: "20.0"})  # Held in the old file's log
+    with open(backend.path(TABLE), mode='rb') as file:
+        original = file.read()
+    assert reopen(backend).find_rows(TABLE, {0: "R2"})[0][2] == "20.0"
+    assert sorted(manifest(backend)["partitions"]) == ["2024-01", "2024-03"]
+    with open(backend.path(TABLE), mode='rb') as file:
+        assert file.read() == original  # The source file stays as it was
+    backend.append_rows(TABLE, [repayment(3, "2024-03-02")], HEADERS)
+    assert [row[0] for row in reopen(backend).read_table(TABLE)[1:]] == ["R1", "R2", "R3"]
+
+def test_changed_partitions_are_sealed_again(backend):
+    backend.append_rows(TABLE, [repayment(1, "2024-01-05"), repayment(2, "2024-01-06")], HEADERS)
+    backend.append_rows(TABLE, [repayment(3, "2024-02-01")], HEADERS)
+    assert manifest(backend)["partitions"]["2024-01"]["sealed"]
+    january = backend.partition_table(TABLE, "2024-01")
+
+    assert backend.update_rows(TABLE, {0: "R1"}, {2: "15.0"}) == 1
+    assert manifest(backend)["partitions"]["2024-01"]["sealed"]
+    assert not os.path.isfile(backend.log_path(january))  # Folded back in by the seal
+    backend.append_rows(TABLE, [repayment(4, "2024-01-07")], HEADERS)
+    assert manifest(backend)["partitions"]["2024-01"]["sealed"]
+    assert backend.delete_rows(TABLE, {0: "R2"}) == 1
+    assert manifest(backend)["partitions"]["2024-01"]["sealed"]
+    assert [(row[0], row[2]) for row in reopen(backend).read_table(january)[1:]] == [("R1", "15.0"), ("R4", "10.0")]
+
+@pytest.mark.skipif(not hasattr(time, "tzset"), reason="needs time.tzset")
+def test_epoch_months_do_not_depend_on_the_time_zone(monkeypatch):
+    february_utc = "1706745600.0"  # 2024-02-01 00:00 UTC, still January west of Greenwich
+    try:
+        for zone in ("UTC", "America/New_York", "Asia/Tokyo"):
+            monkeypatch.setenv("TZ", zone)
+            time.tzset()
+            assert partition_month(february_utc, "epoch") == "2024-02"
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+def save_manifest_from_process(folder):
+    backend = CSVBackend(folder, TableCache())
+    for _ in range(200):
+        backend._save_manifest(TABLE, {"headers": list(HEADERS), "partitions": {}})
+
+def test_processes_write_the_manifest_at_once(backend):
+    processes = [multiprocessing.Process(target=save_manifest_from_process, args=(backend.data_folder,))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+    assert manifest(backend) == {"headers": list(HEADERS), "partitions": {}}
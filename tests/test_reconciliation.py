@@ -0,0 +1,67 @@
+import pytest
+from blockchain import CONTRACT_HEADERS, Blockchain
+from database import Database
+from reconciliation import CONTRACT_LINKS_FILE, Reconciler
+from transactions import TRANSACTION_FILE, TRANSACTION_HEADERS
+
+def purchase(transaction_id, buyer_id, product_id, amount, timestamp):
+    return {"id": transaction_id, "buyer_id": buyer_id, "seller_id": "S1", "product_id": product_id,
+            "amount": amount, "timestamp": timestamp}
+
+def execution(contract_id, buyer_id, product_id, amount):
+    return {"id": f"X{contract_id}", "buyer_id": buyer_id, "seller_id": "S1", "product_id": product_id,
+            "amount": amount, "timestamp": 1000.0, "contract_id": contract_id, "type": "contract_execution"}
+
+def listed(transaction_id, price, status):
+    Database.write_to_csv(TRANSACTION_FILE, ["buyer", "rice", price, status, transaction_id], TRANSACTION_HEADERS)
+
+def contract(contract_id, buyer_id, product_id, price, created, status="Executed"):
+    Database.write_to_csv("smart_contracts.csv", [contract_id, buyer_id, "S1", product_id, price, "",
+                                                  status, created, created + 1], CONTRACT_HEADERS)
+
+@pytest.fixture
+def blockchain(data_folder):
+    blockchain = Blockchain()
+    # C1 and C2 were executed before contract links were recorded; C3 is linked to T3
+    contract("C1", "B1", "P1", 50.0, 100.0)
+    contract("C2", "B2", "P2", 70.0, 300.0)
+    contract("C3", "B1", "P1", 50.0, 210.0)
+    Reconciler.link("C3", ["T3"])
+    listed("T1", 50.0, "Approved")
+    listed("T2", 70.0, "Pending")
+    listed("T3", 50.0, "Approved")
+    blockchain.seal_transactions([purchase("T1", "B1", "P1", 50.0, 90.0), purchase("T3", "B1", "P1", 50.0, 200.0),
+                                  purchase("T2", "B2", "P2", 70.0, 290.0)], "admin")
+    blockchain.seal_transactions([execution("C1", "B1", "P1", 50.0), execution("C2", "B2", "P2", 70.0),
+                                  execution("C3", "B1", "P1", 50.0)], "admin")
+    return blockchain
+
+def links():
+    return sorted(tuple(row) for row in Database.read_from_csv(CONTRACT_LINKS_FILE))
+
+def test_legacy_contracts_are_linked_once(blockchain):
+    for _ in range(2):
+        assert blockchain.reconciler.reconcile(full=True) == [
+            {"kind": "not_approved", "id": "T2", "detail": "its contract was executed but it is Pending"}]
+    # C1 keeps to the purchase made before it; T3 belongs to C3
+    assert links() == [("C1", "T1"), ("C2", "T2"), ("C3", "T3")]
+
+def test_contracts_without_purchases_are_reported_once(blockchain):
+    contract("C4", "B4", "P4", 10.0, 400.0)
+    blockchain.seal_transactions([execution("C4", "B4", "P4", 10.0)], "admin")
+    assert [(item["kind"], item["id"]) for item in blockchain.reconciler.reconcile(full=True)] == [
+        ("unlinked_contract", "C4"), ("not_approved", "T2")]
+    assert [(item["kind"], item["id"]) for item in blockchain.reconciler.reconcile(full=True)] == [
+        ("not_approved", "T2")]
+    assert Reconciler.stored_links(Database.find_rows("smart_contracts.csv", {0: "C4"})) == {"C4": []}
+
+def test_only_new_blocks_are_checked(blockchain):
+    blockchain.reconciler.reconcile()
+    listed("T5", 99.0, "Pending")
+    contract("C6", "B1", "P1", 50.0, 500.0, status="Created")
+    blockchain.seal_transactions([purchase("T5", "B5", "P5", 20.0, 400.0), purchase("T6", "B6", "P6", 5.0, 410.0),
+                                  execution("C6", "B1", "P1", 50.0), execution("C7", "B1", "P1", 50.0)], "admin")
+    assert [(item["kind"], item["id"]) for item in blockchain.reconciler.reconcile()] == [
+        ("amount_mismatch", "T5"), ("missing_transaction", "T6"), ("unknown_contract", "C7"),
+        ("contract_not_executed", "C6")]
+    assert blockchain.reconciler.reconcile() == []
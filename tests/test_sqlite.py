@@ -0,0 +1,51 @@
+import pytest
+from storage import CSVBackend, SQLiteBackend, TableCache
+
+HEADERS = ("Loan ID", "Farmer ID", "Amount", "Interest Rate", "Application Date", "Status",
+           "Approval Date", "Due Date")
+
+def loan(number, status="Pending"):
+    return (f"L{number}", f"F{number % 3}", "100.0", "5", "2025-01-01", status, "", "")
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "farmgate.db"), str(tmp_path))
+    backend.append_rows("loans.csv", [loan(number) for number in range(6)], HEADERS)
+    return backend
+
+def test_rows_keep_their_order_and_layout(backend):
+    backend.append_rows("loans.csv", [("L6", "F0"), loan(7) + ("extra",)], HEADERS)
+    rows = backend.read_table("loans.csv")
+    assert rows[0] == HEADERS
+    assert [row[0] for row in rows[1:]] == [f"L{number}" for number in range(8)]
+    assert rows[7] == ("L6", "F0")  # Short rows come back short
+    assert rows[8][-1] == "extra"
+    assert list(backend.iter_rows("loans.csv")) == rows
+    assert backend.read_table("missing.csv") == []
+
+def test_filters_updates_and_deletes(backend):
+    assert [row[0] for row in backend.find_rows("loans.csv", {1: "F1"})] == ["L1", "L4"]
+    assert [row[0] for row in backend.find_rows("loans.csv", {1: "F1"}, limit=1)] == ["L1"]
+    assert backend.find_rows("loans.csv", {20: "x"}) == []
+    assert backend.update_rows("loans.csv", {0: "L2"}, {5: "Approved"}) == 1
+    assert backend.update_many("loans.csv", [({0: "L3"}, {5: "Paid"}), ({0: "missing"}, {5: "Paid"})]) == 1
+    assert backend.delete_rows("loans.csv", {1: "F0"}) == 2
+    assert [row[0] for row in backend.find_rows_any("loans.csv", [{0: "L5"}, {5: "Approved"}])] == ["L2", "L5"]
+    assert [row[0] for row in list(backend.iter_rows("loans.csv", {5: "Pending"}))[1:]] == ["L1", "L4", "L5"]
+
+def test_state_survives_a_new_connection(backend):
+    backend.update_rows("loans.csv", {0: "L1"}, {5: "Approved"})
+    backend.replace_table("marketplace.csv", [("Product ID", "Name"), ("P1", "Rice")])
+    reopened = SQLiteBackend(backend.db_file, backend.data_folder)
+    assert reopened.find_rows("loans.csv", {0: "L1"})[0][5] == "Approved"
+    assert reopened.read_table("marketplace.csv") == [("Product ID", "Name"), ("P1", "Rice")]
+
+def test_csv_tables_are_imported_with_their_log(tmp_path):
+    csv_backend = CSVBackend(str(tmp_path), TableCache(), compact_bytes=10 ** 9)
+    csv_backend.append_rows("loans.csv", [loan(number) for number in range(6)], HEADERS)
+    csv_backend.update_rows("loans.csv", {0: "L1"}, {5: "Approved"})
+    csv_backend.delete_rows("loans.csv", {0: "L2"})
+    backend = SQLiteBackend(str(tmp_path / "farmgate.db"), str(tmp_path))
+    assert backend.read_table("loans.csv") == csv_backend.read_table("loans.csv")
+    assert backend.find_rows("loans.csv", {0: "L1"})[0][5] == "Approved"
+    assert backend.find_rows("loans.csv", {0: "L2"}) == []
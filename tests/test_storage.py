@@ -0,0 +1,159 @@
+import os
+import threading
+import pytest
+from storage import CSVBackend, TableCache, TableIndex
+
+HEADERS = ("Loan ID", "Farmer ID", "Amount", "Interest Rate", "Application Date", "Status",
+           "Approval Date", "Due Date")
+
+def loan(number, status="Pending"):
+    return (f"L{number}", f"F{number % 3}", "100.0", "5", "2025-01-01", status, "", "")
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = CSVBackend(str(tmp_path), TableCache(), compact_bytes=10 ** 9)
+    backend.append_rows("loans.csv", [loan(number) for number in range(10)], HEADERS)
+    return backend
+
+def reopen(backend):
+    """A backend over the same folder with nothing cached, like a new process"""
+    return CSVBackend(backend.data_folder, TableCache(), compact_bytes=backend.compact_bytes)
+
+def wait_for_compaction():
+    for thread in threading.enumerate():
+        if thread.name.startswith("compact-"):
+            thread.join()
+
+def test_updates_are_logged_and_replayed(backend):
+    with open(backend.path("loans.csv"), mode='rb') as file:
+        original = file.read()
+    assert backend.update_rows("loans.csv", {0: "L3"}, {5: "Approved"}) == 1
+    assert backend.delete_rows("loans.csv", {0: "L4"}) == 1
+    assert backend.update_rows("loans.csv", {5: "Approved"}, {6: "2025-02-01"}) == 1
+
+    with open(backend.path("loans.csv"), mode='rb') as file:
+        assert file.read() == original
+    assert os.path.isfile(backend.log_path("loans.csv"))
+    for reader in (backend, reopen(backend)):
+        rows = reader.read_table("loans.csv")
+        assert len(rows) == 10
+        assert reader.find_rows("loans.csv", {0: "L3"}) == [
+            ("L3", "F0", "100.0", "5", "2025-01-01", "Approved", "2025-02-01", "")]
+        assert reader.find_rows("loans.csv", {0: "L4"}) == []
+        assert [row[0] for row in reader.iter_rows("loans.csv", {5: "Approved"})][1:] == ["L3"]
+
+def test_update_counts_without_loading_the_table(backend):
+    assert backend.update_rows("loans.csv", {0: "L1"}, {5: "Approved"}) == 1
+    assert backend.update_rows("loans.csv", {0: "missing"}, {5: "Approved"}) == 0
+    # Only the rows found through the index were read
+    assert backend.cache.get(backend.path("loans.csv"), backend._signature("loans.csv")) is None
+    assert backend.update_many("loans.csv", [({0: "L1"}, {5: "Paid"}), ({0: "L2"}, {5: "Paid"})]) == 2
+    assert [row[0] for row in backend.find_rows("loans.csv", {5: "Paid"})] == ["L1", "L2"]
+
+def test_find_rows_stops_at_the_limit(backend, monkeypatch):
+    parsed = []
+    read = TableIndex.read
+
+    def counting_read(self, locations):
+        for position, row in read(self, locations):
+            parsed.append(position)
+            yield position, row
+    monkeypatch.setattr(TableIndex, "read", counting_read)
+    backend.update_rows("loans.csv", {0: "L0"}, {5: "Approved"})
+    parsed.clear()
+    assert [row[0] for row in backend.find_rows("loans.csv", {5: "Pending"}, limit=2)] == ["L1", "L2"]
+    assert parsed == [1, 2, 3]  # L0 is indexed as Pending but the log moved it
+
+def test_cached_rows_are_patched(backend):
+    before = backend.read_table("loans.csv")
+    backend.update_rows("loans.csv", {0: "L5"}, {5: "Approved"})
+    backend.delete_rows("loans.csv", {0: "L6"})
+    after = backend.read_table("loans.csv")
+    assert after is not before
+    assert before[6][5] == "Pending"  # Rows already handed out do not change
+    assert after == reopen(backend).read_table("loans.csv")
+    assert [row[0] for row in after[1:]] == [f"L{number}" for number in range(10) if number != 6]
+
+def test_log_records_skip_rows_appended_later(backend):
+    backend.update_rows("loans.csv", {1: "F0"}, {5: "Approved"})
+    backend.append_rows("loans.csv", [loan(12)], HEADERS)  # Farmer F0 as well
+    backend.delete_rows("loans.csv", {1: "F1"})
+    backend.append_rows("loans.csv", [loan(13)], HEADERS)  # Farmer F1
+    for reader in (backend, reopen(backend)):
+        assert reader.find_rows("loans.csv", {0: "L12"})[0][5] == "Pending"
+        assert reader.find_rows("loans.csv", {0: "L13"}) == [loan(13)]
+        assert [row[0] for row in reader.find_rows("loans.csv", {5: "Approved"})] == ["L0", "L3", "L6", "L9"]
+
+def test_compact_folds_the_log_into_the_file(backend):
+    backend.update_rows("loans.csv", {0: "L2"}, {5: "Approved"})
+    backend.delete_rows("loans.csv", {0: "L7"})
+    expected = backend.read_table("loans.csv")
+    backend.compact("loans.csv")
+    assert not os.path.isfile(backend.log_path("loans.csv"))
+    assert reopen(backend).read_table("loans.csv") == expected
+    assert backend.find_rows("loans.csv", {0: "L2"})[0][5] == "Approved"
+    assert backend.update_rows("loans.csv", {0: "L2"}, {5: "Paid"}) == 1
+    assert reopen(backend).find_rows("loans.csv", {0: "L2"})[0][5] == "Paid"
+
+def test_background_compaction_keeps_reads_consistent(tmp_path):
+    backend = CSVBackend(str(tmp_path), TableCache(), compact_bytes=300)
+    backend.append_rows("loans.csv", [loan(number) for number in range(50)], HEADERS)
+    statuses = {}
+    for step in range(200):
+        loan_id = f"L{step * 7 % 50}"
+        statuses[loan_id] = f"S{step}"
+        assert backend.update_rows("loans.csv", {0: loan_id}, {5: statuses[loan_id]}) == 1
+        assert backend.find_rows("loans.csv", {0: loan_id})[0][5] == statuses[loan_id]
+        assert len(list(backend.iter_rows("loans.csv"))) == 51
+    wait_for_compaction()
+    for loan_id, status in statuses.items():
+        assert reopen(backend).find_rows("loans.csv", {0: loan_id})[0][5] == status
+
+def test_derived_values_are_dropped_with_their_entry(tmp_path):
+    cache = TableCache(max_bytes=10 ** 6)
+    backend = CSVBackend(str(tmp_path), cache)
+    backend.append_rows("loans.csv", [loan(number) for number in range(10)], HEADERS)
+    rows = backend.read_table("loans.csv")
+    size = cache._bytes
+    derived = backend.derived("loans.csv", rows, list)
+    assert backend.derived("loans.csv", rows, list) is derived
+    assert cache._bytes == 2 * size  # Counted against the cache budget
+    backend.update_rows("loans.csv", {0: "L1"}, {5: "Approved"})
+    rows = backend.read_table("loans.csv")
+    assert backend.derived("loans.csv", rows, list) is not derived
+    cache.invalidate()
+    assert cache._bytes == 0
+    assert backend.derived("loans.csv", rows, list) is not backend.derived("loans.csv", rows, list)
+
+def test_empty_values_are_indexed(backend):
+    backend.append_rows("loans.csv", [("L10", "", "100.0", "5", "2025-01-01", ""), ("L11",)], HEADERS)
+    backend.update_rows("loans.csv", {0: "L2"}, {5: ""})
+    for reader in (backend, reopen(backend)):
+        assert [row[0] for row in reader.find_rows("loans.csv", {1: ""})] == ["L10"]  # L11 has no farmer
+        assert [row[0] for row in reader.find_rows("loans.csv", {5: ""})] == ["L2", "L10"]
+
+def test_torn_sidecar_line_is_rebuilt(backend):
+    backend.find_rows("loans.csv", {0: "L1"})  # Writes the sidecar
+    backend.append_rows("loans.csv", [loan(12)], HEADERS)
+    index_path = backend.path("loans.csv") + ".idx"
+    with open(index_path, mode='rb') as file:
+        data = file.read()
+    assert data.endswith(b",L12,F0,Pending\r\n")
+    with open(index_path, mode='wb') as file:
+        file.write(data[:-len(b"ding\r\n")])  # Still as many fields as a whole line
+    reader = reopen(backend)
+    assert [row[0] for row in reader.find_rows("loans.csv", {5: "Pending"})][-1] == "L12"
+    reader.append_rows("loans.csv", [loan(13)], HEADERS)
+    assert [row[0] for row in reopen(backend).find_rows("loans.csv", {1: "F1"})][-1] == "L13"
+
+def test_rewrite_with_the_same_inode_and_size_is_noticed(backend):
+    assert backend.find_rows("loans.csv", {5: "Overdue"}) == []
+    path = backend.path("loans.csv")
+    stat = os.stat(path)
+    with open(path, mode='r+b') as file:
+        data = file.read()
+        file.seek(0)
+        file.write(data.replace(b"L3,F0,100.0,5,2025-01-01,Pending", b"L3,F0,100.0,5,2025-01-01,Overdue"))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert os.stat(path).st_size == stat.st_size
+    assert [row[0] for row in backend.find_rows("loans.csv", {5: "Overdue"})] == ["L3"]
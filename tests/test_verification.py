@@ -0,0 +1,48 @@
+import shutil
+import pytest
+import blockchain as blockchain_module
+from blockchain import Block, Blockchain, block_bodies, find_invalid_block
+
+@pytest.fixture
+def blockchain(data_folder):
+    blockchain = Blockchain()
+    for number in range(12):
+        blockchain.seal_transactions([{"id": f"T{number}", "amount": number}], "admin")
+    return blockchain
+
+def restore_with(blockchain, tampered):
+    """Rewrite the block store with some blocks' transactions replaced, keeping their stored hashes"""
+    headers = blockchain.block_store.headers()
+    bodies = blockchain.block_store.bodies(headers)
+    shutil.rmtree(blockchain.block_folder)
+    records = [tuple(entry[:7]) + (tampered.get(position, transactions),)
+               for (position, entry), transactions in zip(headers, bodies)]
+    blockchain.block_store = type(blockchain.block_store)(blockchain.block_folder)
+    blockchain.block_store.append(records)
+    block_bodies.clear()
+    blockchain.load_blockchain()
+
+def test_valid_chain_passes(blockchain):
+    assert len(blockchain.chain) == 13
+    assert blockchain.find_invalid_block_parallel(1, workers=2) is None
+    assert blockchain.find_invalid_block_parallel(6, workers=3) is None
+
+def test_workers_report_the_first_invalid_stored_block(blockchain):
+    restore_with(blockchain, {5: [{"id": "forged"}], 9: []})
+    expected = find_invalid_block(blockchain.chain)
+    assert expected == (5, "Invalid Merkle root for block 5")
+    assert blockchain.find_invalid_block_parallel(1, workers=2) == expected
+    assert blockchain.find_invalid_block_parallel(6, workers=2)[0] == 9
+
+def test_blocks_missing_from_the_store_are_sent_whole(blockchain):
+    original = blockchain.chain[7]
+    blockchain.chain[7] = Block(7, original.timestamp, [{"id": "other"}], "not the previous hash")
+    expected = find_invalid_block(blockchain.chain)
+    assert expected == (7, "Invalid previous hash reference for block 7")
+    assert blockchain.find_invalid_block_parallel(1, workers=2) == expected
+
+def test_full_parallel_audit(blockchain, monkeypatch):
+    monkeypatch.setattr(blockchain_module, "PARALLEL_VERIFY_MIN_BLOCKS", 1)
+    assert blockchain.is_chain_valid(full=True, parallel=True)
+    restore_with(blockchain, {3: [{"id": "forged"}]})
+    assert not blockchain.is_chain_valid(full=True, parallel=True)
@@ -1,24 +1,19 @@
-import csv
-import os
 import uuid
 import time
-from blockchain import Blockchain
+from blockchain import get_blockchain
+from database import Database
 
-# Ensure data folder exists
-DATA_FOLDER = "data"
-TRANSACTION_FILE = os.path.join(DATA_FOLDER, "transactions.csv")
+TRANSACTION_FILE = "transactions.csv"
+TRANSACTION_HEADERS = ["Buyer Name", "Product Name", "Price", "Status", "Transaction ID"]
 
 # Transaction Manager
 class TransactionManager:
     def __init__(self):
-        # Ensure the file exists with headers
-        if not os.path.isfile(TRANSACTION_FILE):
-            with open(TRANSACTION_FILE, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(["Buyer Name", "Product Name", "Price", "Status", "Transaction ID"])
+        # Ensure the table exists with headers
+        Database.create_table(TRANSACTION_FILE, TRANSACTION_HEADERS)
         
         # Initialize blockchain
-        self.blockchain = Blockchain()
+        self.blockchain = get_blockchain()
 
     def record_transaction(self, buyer_id, buyer_name, seller_id, product_id, product_name, price, status="Pending"):
         """Stores transaction data into CSV file and blockchain."""
@@ -26,11 +21,8 @@ class TransactionManager:
         transaction_id = str(uuid.uuid4())[:8]
         
         # Record in traditional CSV for backward compatibility
-        with open(TRANSACTION_FILE, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            if file.tell() == 0:  # File is empty, write header
-                writer.writerow(["Buyer Name", "Product Name", "Price", "Status", "Transaction ID"])
-            writer.writerow([buyer_name, product_name, price, status, transaction_id])
+        Database.write_to_csv(TRANSACTION_FILE, [buyer_name, product_name, price, status, transaction_id],
+                              TRANSACTION_HEADERS)
         
         # Create blockchain transaction
         transaction = {
@@ -62,14 +54,12 @@ class TransactionManager:
 
     def get_transactions(self, show_output=True):
         """Retrieves all transactions from the CSV file."""
-        if not os.path.isfile(TRANSACTION_FILE):
+        if not Database.table_exists(TRANSACTION_FILE):
             if show_output:
                 print("\n No transactions found.\n")
             return []
         
-        with open(TRANSACTION_FILE, mode='r') as file:
-            reader = csv.reader(file)
-            transactions = list(reader)[1:]  
+        transactions = Database.read_from_csv(TRANSACTION_FILE)
         
         if show_output:
             if not transactions:
@@ -78,13 +68,13 @@ class TransactionManager:
                 print("\n Transaction History:")
                 for t in transactions:
                     try:
-                        # Check if transaction has enough elements
-                        if len(t) >= 4:
-                            status_symbol = "" if t[3] == "Approved" else "⏳"
-                            tx_id = f" | ID: {t[4]}" if len(t) >= 5 else ""
-                            print(f"- {status_symbol} Buyer: {t[0]} | Product: {t[1]} | Price: ₱{t[2]} | Status: {t[3]}{tx_id}")
+                        # Records pad missing columns with "", so check the fields themselves
+                        if t.buyer_name and t.product_name and t.price != "" and t.status:
+                            status_symbol = "" if t.status == "Approved" else "⏳"
+                            tx_id = f" | ID: {t.transaction_id}" if t.transaction_id else ""
+                            print(f"- {status_symbol} Buyer: {t.buyer_name} | Product: {t.product_name} | Price: ₱{t.price} | Status: {t.status}{tx_id}")
                         else:
-                            print(f"- Nothing else yet...: {', '.join(t)}")
+                            print(f"- Nothing else yet...: {', '.join(str(value) for value in t if value != '')}")
                     except Exception as e:
                         print(f"- Error displaying transaction: {e}")
                 print()
@@ -108,9 +98,11 @@ class TransactionManager:
         
         return transactions
     
-    def create_smart_contract(self, buyer_id, seller_id, product_id, price, terms="Standard purchase agreement"):
-        """Create a smart contract for a transaction."""
-        contract_id = self.blockchain.create_smart_contract(buyer_id, seller_id, product_id, price, terms)
+    def create_smart_contract(self, buyer_id, seller_id, product_id, price, terms="Standard purchase agreement",
+                              transaction_id=None):
+        """Create a smart contract for a transaction, linked to its transaction ID if given."""
+        contract_id = self.blockchain.create_smart_contract(buyer_id, seller_id, product_id, price, terms,
+                                                            transaction_id)
         print(f"\n Smart contract created for purchase")
         print(f"   Contract ID: {contract_id}\n")
         return contract_id
@@ -120,42 +112,40 @@ class TransactionManager:
         success, message = self.blockchain.execute_smart_contract(contract_id)
         if success:
             print(f"\n Smart contract executed successfully: {contract_id}\n")
-            # Mine the blockchain to confirm the transaction
-            self.blockchain.mine_pending_transactions("admin")
+            # The contract's transaction is mined with the next scheduled block
         else:
             print(f"\n Failed to execute smart contract: {message}\n")
         return success, message
     
-    def verify_blockchain(self):
-        """Verify the integrity of the blockchain."""
-        return self.blockchain.is_chain_valid()
+    def execute_contracts(self, contract_ids):
+        """Execute many smart contracts in one pass and seal them in a single block."""
+        results = self.blockchain.execute_contracts(contract_ids)
+        executed = sum(1 for success, _ in results.values() if success)
+        print(f"\n {executed} of {len(results)} smart contracts executed\n")
+        for contract_id, (success, message) in results.items():
+            if not success:
+                print(f"   {contract_id}: {message}")
+        return results
+    
+    def reconcile(self, full=False):
+        """Report where transactions.csv and the blockchain ledger disagree, for blocks since the last run."""
+        return self.blockchain.reconciler.reconcile(full)
+    
+    def verify_blockchain(self, full=False, parallel=False):
+        """Verify the integrity of the blockchain; full=True re-hashes every block."""
+        return self.blockchain.is_chain_valid(full, parallel)
 
     def approve_transaction(self, transaction_id):
         """Updates transaction status to Approved and mines the blockchain."""
-        transactions = self.get_transactions()
-        updated_transactions = []
-        found = False
-        buyer_name = ""
-        product_name = ""
+        match = {3: "Pending", 4: transaction_id}
+        transaction = Database.find_row(TRANSACTION_FILE, match)
 
         # Update in traditional system
-        for transaction in transactions:
-            if len(transaction) >= 5 and transaction[4] == transaction_id and transaction[3] == "Pending":
-                transaction[3] = "Approved"
-                found = True
-                buyer_name = transaction[0]
-                product_name = transaction[1]
-            updated_transactions.append(transaction)
-
-        if found:
-            # Update CSV file
-            with open(TRANSACTION_FILE, mode='w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(["Buyer Name", "Product Name", "Price", "Status", "Transaction ID"])
-                writer.writerows(updated_transactions)
+        if transaction and Database.update_rows(TRANSACTION_FILE, match, {3: "Approved"}):
+            buyer_name = transaction[0]
+            product_name = transaction[1]
             
-            # Mine pending transactions in blockchain
-            self.blockchain.mine_pending_transactions("admin")
+            # Pending blockchain transactions are mined by the block scheduler
             
             print(f"\n Transaction Approved for {buyer_name}: {product_name}")
             print(f"   Transaction ID: {transaction_id} (secured by blockchain)\n")
@@ -35,8 +35,7 @@ class User:
 
     def check_existing_user(self, username):
         """Check if a username already exists in the database."""
-        users = Database.read_from_csv(self.users_file)
-        return any(user[1] == username for user in users)
+        return Database.find_row(self.users_file, {1: username}) is not None
 
     def register(self, username, password, role, email):
         """
@@ -84,27 +83,26 @@ class User:
         Authenticate a user with username and password.
         Returns a tuple (success, user_details or error_message)
         """
-        users = Database.read_from_csv(self.users_file)
         hashed_input_password = self.hash_password(password)
 
-        for user in users:
-            if user[1] == username and user[2] == hashed_input_password:
-                # Update the current instance with user data
-                self.user_id = user[0]
-                self.name = username
-                self.email = user[4]
-                self.password = user[2]  # Hashed password
-                self.role = user[3]
-                
-                user_details = {
-                    "user_id": user[0],
-                    "username": username,
-                    "role": user[3],
-                    "email": user[4]
-                }
-                
-                return True, user_details
-                
+        user = Database.find_row(self.users_file, {1: username, 2: hashed_input_password})
+        if user:
+            # Update the current instance with user data
+            self.user_id = user[0]
+            self.name = username
+            self.email = user[4]
+            self.password = user[2]  # Hashed password
+            self.role = user[3]
+            
+            user_details = {
+                "user_id": user[0],
+                "username": username,
+                "role": user[3],
+                "email": user[4]
+            }
+            
+            return True, user_details
+            
         return False, "Invalid username or password"
 
     def updateProfile(self, field, new_value):
@@ -119,53 +117,41 @@ class User:
         if field not in ["username", "email", "password"]:
             return False, f"Cannot update field: {field}"
             
-        users = Database.read_from_csv(self.users_file)
-        updated_users = []
-        found = False
+        if Database.find_row(self.users_file, {0: self.user_id}) is None:
+            return False, "User not found"
         
-        for user in users:
-            if user[0] == self.user_id:
-                found = True
-                
-                # Handle different field updates
-                if field == "username":
-                    # Check if new username already exists
-                    if any(u[1] == new_value and u[0] != self.user_id for u in users):
-                        return False, "Username already exists"
-                    user[1] = new_value
-                    self.name = new_value
-                    
-                elif field == "email":
-                    # Validate email format
-                    if "@" not in new_value or "." not in new_value:
-                        return False, "Invalid email format"
-                    user[4] = new_value
-                    self.email = new_value
-                    
-                elif field == "password":
-                    # Validate password length
-                    if len(new_value) < 6:
-                        return False, "Password must be at least 6 characters long"
-                    hashed_password = self.hash_password(new_value)
-                    user[2] = hashed_password
-                    self.password = hashed_password
-                    
-            updated_users.append(user)
+        # Handle different field updates
+        if field == "username":
+            # Check if new username already exists
+            if any(u[0] != self.user_id for u in Database.find_rows(self.users_file, {1: new_value})):
+                return False, "Username already exists"
+            column, stored_value = 1, new_value
             
-        if not found:
-            return False, "User not found"
+        elif field == "email":
+            # Validate email format
+            if "@" not in new_value or "." not in new_value:
+                return False, "Invalid email format"
+            column, stored_value = 4, new_value
+            
+        elif field == "password":
+            # Validate password length
+            if len(new_value) < 6:
+                return False, "Password must be at least 6 characters long"
+            column, stored_value = 2, self.hash_password(new_value)
             
         try:
-            # Write updated data back to CSV
-            with open(f"data/{self.users_file}", mode='w', newline='') as file:
-                import csv
-                writer = csv.writer(file)
-                writer.writerow(self.headers)
-                writer.writerows(updated_users)
-                
-            return True, f"Successfully updated {field}"
+            # Write the updated field back to storage
+            Database.update_rows(self.users_file, {0: self.user_id}, {column: stored_value})
         except Exception as e:
             return False, f"Error updating profile: {e}"
+        
+        if field == "username":
+            self.name = stored_value
+        elif field == "email":
+            self.email = stored_value
+        else:
+            self.password = stored_value
+        return True, f"Successfully updated {field}"
 
     def get_user_details(self):
         """Return the current user's details as a dictionary."""